@@ -1,16 +1,104 @@
 import os
 import json
-from constants import PROMPT, AUTO_CATEGORIZE_PROMPT, BATCH_AUTOPOPULATE_PROMPT, PROMPT_MULTI
+import time
+import asyncio
+import re
+import threading
+from constants import PROMPT, AUTO_CATEGORIZE_PROMPT, BATCH_AUTOPOPULATE_PROMPT, BATCH_CATEGORIZE_PROMPT, PROMPT_MULTI
 from datetime import datetime
+from llm_cache import build_cache, cache_key
+from llm_providers import get_provider, run_sync
+
+# Cache of parsed LLM results (see llm_cache.py)
+llm_cache = build_cache()
+
+# Max LLM calls in flight for one batch operation, and max calls per second
+# across the whole process (0 = unlimited)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 4))
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", 0))
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` start per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+rate_limiter = RateLimiter(LLM_RATE_LIMIT)
+
+# Approximate tokens of memory text sent per batch autopopulate call
+AUTOPOPULATE_TOKEN_BUDGET = int(os.getenv("AUTOPOPULATE_TOKEN_BUDGET", 2000))
+# The reply lists selected ids, so the batch must also fit the 800 token response
+AUTOPOPULATE_MAX_BATCH = 40
+
+# Approximate tokens of memory text per batched categorization call; the reply
+# has an id and folder list per memory, so batches are also capped in size
+CATEGORIZE_TOKEN_BUDGET = int(os.getenv("CATEGORIZE_TOKEN_BUDGET", 2000))
+CATEGORIZE_MAX_BATCH = 20
+
+# Full chats are split into chunks of about FULL_CHAT_CHUNK_TOKENS on message
+# boundaries; each chunk repeats the last FULL_CHAT_CHUNK_OVERLAP messages of the
+# previous one, and up to FULL_CHAT_CONCURRENCY chunks are extracted at once.
+# Merged memories whose words overlap by FULL_CHAT_DEDUPE_SIMILARITY are dropped.
+FULL_CHAT_CHUNK_TOKENS = int(os.getenv("FULL_CHAT_CHUNK_TOKENS", 3000))
+FULL_CHAT_CHUNK_OVERLAP = int(os.getenv("FULL_CHAT_CHUNK_OVERLAP", 1))
+FULL_CHAT_CONCURRENCY = int(os.getenv("FULL_CHAT_CONCURRENCY", LLM_CONCURRENCY))
+FULL_CHAT_DEDUPE_SIMILARITY = float(os.getenv("FULL_CHAT_DEDUPE_SIMILARITY", 0.8))
+# A new message in a "role: text" transcript starts after a blank line
+TRANSCRIPT_MESSAGE_BOUNDARY = re.compile(r"\n\s*\n(?=(?:user|assistant|system|tool): )")
+
+
+async def amap_concurrently(afn, items, max_concurrency=None):
+    """Await afn(item) for every item with at most max_concurrency (default LLM_CONCURRENCY) in flight, keeping order"""
+    slots = asyncio.Semaphore(max_concurrency or LLM_CONCURRENCY)
+
+    async def run(item):
+        async with slots:
+            return await afn(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+def map_concurrently(afn, items, max_concurrency=None):
+    """Sync entry point for amap_concurrently: fan out LLM coroutines from a route or job"""
+    return run_sync(amap_concurrently(afn, items, max_concurrency))
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def batch_by_token_budget(items, token_budget, max_items, text_key="text"):
+    """
+    Group dicts into batches whose text fits within token_budget (an item that is
+    too large on its own gets its own batch). Yields lists, preserving order.
+    """
+    batch, used = [], 0
+    for item in items:
+        # Each line also carries the "- ID: ... |" prefix
+        cost = estimate_tokens(item[text_key]) + 10
+        if batch and (used + cost > token_budget or len(batch) >= max_items):
+            yield batch
+            batch, used = [], 0
+        batch.append(item)
+        used += cost
+    if batch:
+        yield batch
 
-provider = os.getenv("LLM_PROVIDER", "claude").lower()
-if provider == "openai":
-    from openai import OpenAI
-    client = OpenAI()
-else:
-    from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
-    client = Anthropic()
-        
 
 def parse_insights_from_text(text):
     """Parse insights from plain text if JSON parsing fails"""
@@ -50,46 +138,26 @@ def parse_insights_from_text(text):
     return insights
 
 
-def call_llm_with_prompt(prompt):
-    provider = os.getenv("LLM_PROVIDER", "claude").lower()
-    if provider == "openai":
-        if not os.getenv("OPENAI_API_KEY"):
-            raise Exception("OpenAI API key not configured")
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=800,
-        )
-        content = response.choices[0].message.content
-
-    elif provider == "claude":
-        if not os.getenv("ANTHROPIC_API_KEY"):
-            raise Exception("Anthropic API key not configured")
-        from anthropic import Anthropic
-        anthropic_client = Anthropic()
-        response = anthropic_client.messages.create(
-            model="claude-3-5-haiku-latest",
-            max_tokens=800,
-            temperature=0.3,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        content = ""
-        for block in response.content:
-            if block.type == "text":
-                content += block.text
-        content = content.strip()
-
-    if not content:
-        raise Exception("No response content received")
-    return content
-
-
-def generate_insights(message_text):
+async def acall_llm_with_prompt(prompt):
+    """Reply text from the configured provider (see llm_providers.py)"""
+    await rate_limiter.wait()
+    return await get_provider().acomplete(prompt)
+
+
+def llm_cache_key(template, **inputs):
+    """Cache key for a prompt template and its inputs under the current provider and model"""
+    provider = get_provider()
+    return cache_key(provider.name, provider.model, template, inputs)
+
+
+async def agenerate_insights(message_text, use_cache=True):
+    key = llm_cache_key(PROMPT, message_text=message_text)
+    cached = await llm_cache.aget(key, use_cache)
+    if cached is not None:
+        return cached
     try:
         prompt = PROMPT.format(message_text=message_text)
-        content = call_llm_with_prompt(prompt)
+        content = await acall_llm_with_prompt(prompt)
         try:
             parsed_response = json.loads(content)
             if (
@@ -114,20 +182,41 @@ def generate_insights(message_text):
         ]
         if not insights:
             raise Exception("No valid insights extracted")
+        await llm_cache.aset(key, insights)
         return insights
     except Exception as e:
         print(f"Error generating insights: {e}")
         return [f"Important message: {message_text[:100]}..."]
 
 
-def generate_insights_full_chat(message_text):
+async def agenerate_insights_full_chat(message_text, use_cache=True):
     """
     Generate insights from a full chat message text.
-    This function is used for the full chat memory creation.
+    This function is used for the full chat memory creation. Chats longer than
+    FULL_CHAT_CHUNK_TOKENS are split on message boundaries into overlapping
+    chunks, memories are extracted from the chunks concurrently, and the
+    results are merged with near-duplicates dropped. Each chunk is cached on
+    its own, so re-syncing a chat that has grown only re-extracts new chunks.
     """
+    chunks = chunk_transcript(message_text, FULL_CHAT_CHUNK_TOKENS, FULL_CHAT_CHUNK_OVERLAP)
+    results = await amap_concurrently(
+        lambda chunk: _aextract_chunk_memories(chunk, use_cache), chunks, FULL_CHAT_CONCURRENCY
+    )
+    extracted = [memories for memories in results if memories is not None]
+    if not extracted:
+        return [f"Important message: {message_text[:100]}..."]
+    return merge_memories(extracted)
+
+
+async def _aextract_chunk_memories(chunk_text, use_cache):
+    """Memories from one chunk of a full chat, or None if the call or its parsing failed"""
+    key = llm_cache_key(PROMPT_MULTI, message_text=chunk_text)
+    cached = await llm_cache.aget(key, use_cache)
+    if cached is not None:
+        return cached
     try:
-        prompt = PROMPT_MULTI.format(message_text=message_text)
-        content = call_llm_with_prompt(prompt)
+        prompt = PROMPT_MULTI.format(message_text=chunk_text)
+        content = await acall_llm_with_prompt(prompt)
         try:
             parsed_response = json.loads(content)
             if (
@@ -144,35 +233,155 @@ def generate_insights_full_chat(message_text):
             insights = parse_insights_from_text(content)
         if not isinstance(insights, list):
             raise Exception("Invalid insights format")
+        await llm_cache.aset(key, insights)
         return insights
     except Exception as e:
         print(f"Error generating insights for full chat: {e}")
-        return [f"Important message: {message_text[:100]}..."]
+        return None
+
+
+def split_transcript(text, max_tokens):
+    """
+    Split a full chat ("user: ...\n\nassistant: ..." as sent by the extension)
+    into messages. Messages longer than max_tokens are split further on
+    paragraphs, and paragraphs that are still too long on character count.
+    """
+    pieces = []
+    for message in TRANSCRIPT_MESSAGE_BOUNDARY.split(text):
+        message = message.strip()
+        if not message:
+            continue
+        if estimate_tokens(message) <= max_tokens:
+            pieces.append(message)
+            continue
+        max_chars = max_tokens * 4
+        current = ""
+        for paragraph in message.split("\n\n"):
+            for start in range(0, len(paragraph), max_chars):
+                part = paragraph[start:start + max_chars]
+                if current and len(current) + len(part) + 2 > max_chars:
+                    pieces.append(current)
+                    current = part
+                else:
+                    current = f"{current}\n\n{part}" if current else part
+        if current:
+            pieces.append(current)
+    return pieces
 
 
-def categorize_memory_to_folders(memory_text, folders):
+def chunk_transcript(text, chunk_tokens, overlap):
+    """
+    Group a full chat's messages into chunks of about chunk_tokens, each
+    starting with the last `overlap` messages of the previous chunk so context
+    that spans a boundary isn't lost. Returns the chunk texts in order.
+    """
+    chunks, current, used = [], [], 0
+    for message in split_transcript(text, chunk_tokens):
+        cost = estimate_tokens(message)
+        if current and used + cost > chunk_tokens:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else []
+            used = sum(estimate_tokens(m) for m in current)
+            if current and used + cost > chunk_tokens:
+                current, used = [], 0
+        current.append(message)
+        used += cost
+    if current:
+        chunks.append(current)
+    return ["\n\n".join(chunk) for chunk in chunks]
+
+
+def merge_memories(memory_lists):
+    """
+    Flatten per-chunk memories in order, dropping any whose words overlap an
+    earlier memory's by FULL_CHAT_DEDUPE_SIMILARITY or more (Jaccard).
+    """
+    merged, seen = [], []
+    for memories in memory_lists:
+        for memory in memories:
+            if not memory or not isinstance(memory, str) or not memory.strip():
+                continue
+            words = set(re.findall(r"\w+", memory.lower()))
+            if any(
+                len(words & other) / len(words | other) >= FULL_CHAT_DEDUPE_SIMILARITY
+                for other in seen if words or other
+            ):
+                continue
+            merged.append(memory.strip())
+            seen.append(words)
+    return merged
+
+
+async def agenerate_multi_message_insight(messages_text, use_cache=True):
+    """Generate a single synthesized insight from multiple messages using PROMPT_MULTI."""
+    # Same prompt as generate_insights_full_chat but a different result shape, so a separate key
+    key = llm_cache_key(PROMPT_MULTI, message_text=messages_text, combined=True)
+    cached = await llm_cache.aget(key, use_cache)
+    if cached is not None:
+        return cached
+    try:
+        prompt = PROMPT_MULTI.format(message_text=messages_text)
+        content = await acall_llm_with_prompt(prompt)
+        try:
+            parsed_response = json.loads(content)
+            if parsed_response and isinstance(parsed_response, dict) and "memories" in parsed_response:
+                memories = parsed_response["memories"]
+                if isinstance(memories, list):
+                    # Join the list into a single string for the return value
+                    insight = "\n".join(memories)
+                else:
+                    raise Exception("Invalid response format - 'memories' is not a list")
+            else:
+                raise Exception("Invalid response format - expected 'memories' key")
+        except json.JSONDecodeError:
+            # If JSON parsing fails, just use the raw text
+            insight = content
+        if not insight or not isinstance(insight, str) or not insight.strip():
+            raise Exception("No valid insight extracted")
+        await llm_cache.aset(key, insight.strip())
+        return insight.strip()
+    except Exception as e:
+        print(f"Error generating multi-message insight: {e}")
+        return f"Important insight: {messages_text[:100]}..."
+
+
+def format_folder_list(folders):
+    return "\n".join([
+        f"- {f['name']}: {f.get('description', '')}" for f in folders
+    ])
+
+
+def clean_folder_names(folder_names):
+    """Validate a list of folder names returned by the LLM"""
+    if not isinstance(folder_names, list):
+        raise Exception("Expected a list of folder names")
+    folder_names = [str(f).strip() for f in folder_names if f and isinstance(f, str)]
+    # fix the problem where it picks misc with other folders, misc should be alone
+    if len(folder_names) > 1 and "Misc" in folder_names:
+        folder_names = [f for f in folder_names if f != "Misc"]
+    return folder_names
+
+
+async def acategorize_memory_to_folders(memory_text, folders, use_cache=True):
     """
     Given a memory text and a list of folders (dicts with 'name' and 'description'),
     call the LLM to categorize the memory into one or more folders.
     Returns a list of folder names.
     """
-    folder_list_str = "\n".join([
-        f"- {f['name']}: {f.get('description', '')}" for f in folders
-    ])
+    folder_list_str = format_folder_list(folders)
+    key = llm_cache_key(AUTO_CATEGORIZE_PROMPT, memory_text=memory_text, folder_list_str=folder_list_str)
+    cached = await llm_cache.aget(key, use_cache)
+    if cached is not None:
+        return cached
     prompt = AUTO_CATEGORIZE_PROMPT.format(
         memory_text=memory_text,
         folder_list_str=folder_list_str
     )
     try:
-        content = call_llm_with_prompt(prompt)
+        content = await acall_llm_with_prompt(prompt)
         try:
-            folder_names = json.loads(content)
-            if not isinstance(folder_names, list):
-                raise Exception("Expected a list of folder names")
-            folder_names = [str(f).strip() for f in folder_names if f and isinstance(f, str)]
-            # fix the problem where it picks misc with other folders, misc should be alone
-            if len(folder_names) > 1 and "Misc" in folder_names:
-                folder_names = [f for f in folder_names if f != "Misc"]
+            folder_names = clean_folder_names(json.loads(content))
+            await llm_cache.aset(key, folder_names)
         except Exception as e:
             print(f"Error parsing LLM folder response: {e}")
             folder_names = []
@@ -184,7 +393,68 @@ def categorize_memory_to_folders(memory_text, folders):
         return []
 
 
-def batch_autopopulate_memories_to_folder(folder_name, folder_description, memories):
+async def abatch_categorize_memories(memories, folders, use_cache=True):
+    """
+    Categorize many memories (dicts with 'id' and 'text') with one LLM call per
+    token-budgeted batch. Returns {id: [folder names]}. Memories missing from a
+    batch's response (or from a response that can't be parsed) fall back to
+    single-memory calls. Results are cached per memory
+    under the same key categorize_memory_to_folders uses, so only uncached
+    memories are sent.
+    """
+    folder_list_str = format_folder_list(folders)
+    results = {}
+    uncached = []
+    for m in memories:
+        key = llm_cache_key(AUTO_CATEGORIZE_PROMPT, memory_text=m["text"], folder_list_str=folder_list_str)
+        cached = await llm_cache.aget(key, use_cache)
+        if cached is not None:
+            results[m["id"]] = cached
+        else:
+            uncached.append(m)
+    batches = list(batch_by_token_budget(uncached, CATEGORIZE_TOKEN_BUDGET, CATEGORIZE_MAX_BATCH))
+    for batch_result in await amap_concurrently(lambda batch: _acategorize_batch(batch, folders), batches):
+        results.update(batch_result)
+    return results
+
+
+async def _acategorize_batch(memories, folders):
+    memories_list_str = "\n".join([
+        f"- ID: {m['id']} | {m['text']}" for m in memories
+    ])
+    folder_list_str = format_folder_list(folders)
+    prompt = BATCH_CATEGORIZE_PROMPT.format(
+        folder_list_str=folder_list_str,
+        memories_list_str=memories_list_str
+    )
+    results = {}
+    try:
+        content = await acall_llm_with_prompt(prompt)
+        mapping = json.loads(content)
+        if not isinstance(mapping, dict):
+            raise Exception("Expected an object mapping IDs to folder names")
+        for m in memories:
+            if m["id"] in mapping:
+                try:
+                    results[m["id"]] = clean_folder_names(mapping[m["id"]])
+                    await llm_cache.aset(
+                        llm_cache_key(AUTO_CATEGORIZE_PROMPT, memory_text=m["text"], folder_list_str=folder_list_str),
+                        results[m["id"]],
+                    )
+                except Exception as e:
+                    print(f"Error parsing folders for memory {m['id']}: {e}")
+    except Exception as e:
+        print(f"Error in batch categorization, falling back to single calls: {e}")
+    missing = [m for m in memories if m["id"] not in results]
+    # Already cache misses in abatch_categorize_memories
+    fallback = await amap_concurrently(
+        lambda m: acategorize_memory_to_folders(m["text"], folders, use_cache=False), missing
+    )
+    results.update(zip([m["id"] for m in missing], fallback))
+    return results
+
+
+async def abatch_autopopulate_memories_to_folder(folder_name, folder_description, memories, use_cache=True):
     """
     Given a folder name, description, and a list of memories (dicts with 'id' and 'text'),
     call the LLM to select which memories should belong to the folder.
@@ -193,18 +463,24 @@ def batch_autopopulate_memories_to_folder(folder_name, folder_description, memor
     memories_list_str = "\n".join([
         f"- ID: {m['id']} | {m['text']}" for m in memories
     ])
+    key = llm_cache_key(BATCH_AUTOPOPULATE_PROMPT, folder_name=folder_name,
+                        folder_description=folder_description, memories_list_str=memories_list_str)
+    cached = await llm_cache.aget(key, use_cache)
+    if cached is not None:
+        return cached
     prompt = BATCH_AUTOPOPULATE_PROMPT.format(
         folder_name=folder_name,
         folder_description=folder_description,
         memories_list_str=memories_list_str
     )
     try:
-        content = call_llm_with_prompt(prompt)
+        content = await acall_llm_with_prompt(prompt)
         try:
             id_list = json.loads(content)
             if not isinstance(id_list, list):
                 raise Exception("Expected a list of IDs")
             id_list = [str(i).strip() for i in id_list if i and isinstance(i, str)]
+            await llm_cache.aset(key, id_list)
         except Exception as e:
             print(f"Error parsing LLM batch autopopulate response: {e}")
             id_list = []
@@ -212,3 +488,48 @@ def batch_autopopulate_memories_to_folder(folder_name, folder_description, memor
     except Exception as e:
         print(f"Error in batch_autopopulate_memories_to_folder: {e}")
         return []
+
+
+async def acategorize_each(memories, folders, use_cache=True):
+    """
+    Categorize memories (dicts with 'id' and 'text') with one single-memory LLM
+    call each, LLM_CONCURRENCY at a time. Returns {id: [folder names]}.
+    """
+    results = await amap_concurrently(
+        lambda m: acategorize_memory_to_folders(m["text"], folders, use_cache), memories
+    )
+    return dict(zip([m["id"] for m in memories], results))
+
+
+# --- Sync wrappers: routes and jobs call these; the work runs on the shared event loop ---
+
+def call_llm_with_prompt(prompt):
+    return run_sync(acall_llm_with_prompt(prompt))
+
+
+def generate_insights(message_text, use_cache=True):
+    return run_sync(agenerate_insights(message_text, use_cache))
+
+
+def generate_insights_full_chat(message_text, use_cache=True):
+    return run_sync(agenerate_insights_full_chat(message_text, use_cache))
+
+
+def generate_multi_message_insight(messages_text, use_cache=True):
+    return run_sync(agenerate_multi_message_insight(messages_text, use_cache))
+
+
+def categorize_memory_to_folders(memory_text, folders, use_cache=True):
+    return run_sync(acategorize_memory_to_folders(memory_text, folders, use_cache))
+
+
+def categorize_each(memories, folders, use_cache=True):
+    return run_sync(acategorize_each(memories, folders, use_cache))
+
+
+def batch_categorize_memories(memories, folders, use_cache=True):
+    return run_sync(abatch_categorize_memories(memories, folders, use_cache))
+
+
+def batch_autopopulate_memories_to_folder(folder_name, folder_description, memories, use_cache=True):
+    return run_sync(abatch_autopopulate_memories_to_folder(folder_name, folder_description, memories, use_cache))
@@ -1,56 +1,156 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from gridfs.errors import NoFile
 from bson import ObjectId
 import os
 from dotenv import load_dotenv
 import json
 from datetime import datetime
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from constants import PROMPT, PROMPT_MULTI
 from uuid import uuid4
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
-from LLM import generate_insights, categorize_memory_to_folders, batch_autopopulate_memories_to_folder, generate_insights_full_chat
+from LLM import generate_insights, categorize_memory_to_folders, generate_insights_full_chat, map_concurrently, batch_categorize_memories, llm_cache
+from LLM import generate_multi_message_insight, categorize_each, abatch_autopopulate_memories_to_folder, agenerate_insights_full_chat
+from LLM import batch_by_token_budget, AUTOPOPULATE_TOKEN_BUDGET, AUTOPOPULATE_MAX_BATCH, LLM_CONCURRENCY
+from embeddings import EMBEDDING_FIELDS, attach_embeddings, ensure_embeddings, load_embedding_model, embedding_matrix
+from embeddings import build_embedding_text
+from embedding_service import EmbeddingService, EMBEDDING_MODEL_LOAD
+from vector_index import VectorIndexCache
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from db import client as mongo_client, messages_collection, folders_collection, users_collection, imports_bucket, index_bootstrap
+from db import messages_version, bump_messages_version
+from importer import iter_conversations, conversation_transcript, conversation_timestamp
+from dedupe import DEDUPE_ON_INGEST, find_duplicates, find_stored_near_duplicate, mark_seen, find_stored_duplicates
+from dedupe import merge_duplicates
+from folders import (
+    add_to_folder, add_memberships, remove_from_folder, remove_messages_from_all_folders, delete_folder_memberships,
+    clear_memberships, folder_message_ids, folder_size, folder_message_map, categorized_message_ids,
+    migrate_user_memberships,
+)
+from jobs import job_handler, enqueue_job, get_job, serialize_job, update_job_progress, JobWorkerPool, JOB_WORKERS
+from itertools import islice
+from categorizer import categorize_memory, categorize_memories, invalidate_centroids, metrics as categorization_metrics
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Next-Offset", "X-Next-Cursor"])
 
-# MongoDB connection
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-client = MongoClient(MONGO_URI)
-db = client["memory_chat"]
-messages_collection = db["messages"]
-folders_collection = db["folders"]
-users_collection = db["users"]
+# Stored embeddings and dedupe/job/import bookkeeping are internal; never
+# return them to the extension
+INTERNAL_MESSAGE_FIELDS = EMBEDDING_FIELDS + ("contentHash", "lastSeenAt", "jobId", "importJobId", "importIndex")
+MESSAGE_PROJECTION = {field: 0 for field in INTERNAL_MESSAGE_FIELDS}
 
-# Sentence transformer for semantic search
-try:
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    print("Semantic search model loaded successfully")
-except Exception as e:
-    print(f"Error loading semantic search model: {e}")
-    model = None
+# Default similarity cut-off for semantic search results
+DEFAULT_MIN_SIMILARITY = float(os.getenv("SEARCH_MIN_SIMILARITY", 0.05))
 
-# Anthropic Claude setup
-anthropic_client = Anthropic()
+# Search rankers: semantic (cosine), lexical (BM25), or both fused (hybrid)
+SEARCH_MODES = ("hybrid", "semantic", "lexical")
+# Candidates each ranker contributes to a hybrid page, as a multiple of the page window
+HYBRID_CANDIDATE_FACTOR = 3
+
+# Largest page the paginated list endpoints will return
+MAX_PAGE_SIZE = 1000
+
+# Conversations extracted concurrently (and checkpointed together) by an import job
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", LLM_CONCURRENCY))
+# Worker threads per process for import jobs, which run on their own queue so a
+# long import never holds the workers that process new messages
+IMPORT_JOB_WORKERS = int(os.getenv("IMPORT_JOB_WORKERS", 1))
+
+# Dev server (python app.py) debug mode, which runs the server in a child
+# process restarted by the reloader. The parent only watches files, so it
+# loads no model and starts no background threads.
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "true").lower() == "true"
+RELOADER_PARENT = __name__ == "__main__" and FLASK_DEBUG and os.getenv("WERKZEUG_RUN_MAIN") != "true"
+
+# Sentence transformer for semantic search, behind the micro-batching
+# embedding service so concurrent requests share forward passes. Loaded per
+# EMBEDDING_MODEL_LOAD (in the background by default) so startup isn't blocked.
+model = EmbeddingService(load_embedding_model)
+if not RELOADER_PARENT:
+    if EMBEDDING_MODEL_LOAD == "eager":
+        model.load()
+    elif EMBEDDING_MODEL_LOAD == "background":
+        model.load_in_background()
+
+def load_user_vectors(userID):
+    """Load (ids, vectors) for a user's messages, embedding any that are missing"""
+    messages = list(messages_collection.find(
+        {"userID": userID}, {"text": 1, "insights": 1, "embedding": 1, "embeddingHash": 1}
+    ))
+    if not messages or not model:
+        return [], None
+    vectors = ensure_embeddings(model, messages_collection, messages)
+    return [str(m["_id"]) for m in messages], vectors
+
+
+def load_user_texts(userID):
+    """Load (ids, texts) for a user's messages, for the lexical index"""
+    messages = list(messages_collection.find({"userID": userID}, {"text": 1, "insights": 1}))
+    return [str(m["_id"]) for m in messages], [build_embedding_text(m) for m in messages]
+
+
+# Per-user in-memory vector and BM25 indexes, built on first search
+vector_indexes = VectorIndexCache(load_user_vectors)
+lexical_indexes = VectorIndexCache(load_user_texts, index_class=BM25Index)
 
 
 @app.route("/api/messages", methods=["GET"])
 def get_messages():
-    """Get all messages for a user"""
+    """
+    Get messages for a user, oldest first.
+    Optional query params:
+      limit  - page size; the next page's cursor is returned in X-Next-Cursor
+      cursor - return messages after this message _id
+      fields - comma-separated fields to return (_id is always included)
+      since  - only messages with a timestamp after this ISO datetime
+    """
     try:
         userID = request.args.get("userUUID")
         if not userID:
             return jsonify({"error": "userUUID is required"}), 400
-        messages = list(messages_collection.find({"userID": userID}))
-        for message in messages:
-            message["_id"] = str(message["_id"])
-        return jsonify(messages)
+        try:
+            limit = parse_int_param(request.args, "limit", None, minimum=1)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if limit is not None:
+            limit = min(limit, MAX_PAGE_SIZE)
+        query = {"userID": userID}
+        cursor_id = request.args.get("cursor")
+        if cursor_id:
+            if not ObjectId.is_valid(cursor_id):
+                return jsonify({"error": "cursor is not a valid message id"}), 400
+            query["_id"] = {"$gt": ObjectId(cursor_id)}
+        since = request.args.get("since")
+        if since:
+            try:
+                datetime.fromisoformat(since)
+            except ValueError:
+                return jsonify({"error": "since must be an ISO datetime"}), 400
+            query["timestamp"] = {"$gt": since}
+        projection = MESSAGE_PROJECTION
+        fields = request.args.get("fields")
+        if fields:
+            requested = [f.strip() for f in fields.split(",") if f.strip()]
+            projection = {f: 1 for f in requested if f not in INTERNAL_MESSAGE_FIELDS}
+            if not projection:
+                projection = {"_id": 1}
+        messages = messages_collection.find(query, projection).sort("_id", 1)
+        next_cursor = None
+        if limit is not None:
+            # Bounded page: read one extra document to know if there is a next page
+            messages = list(messages.limit(limit + 1))
+            if len(messages) > limit:
+                messages = messages[:limit]
+                next_cursor = str(messages[-1]["_id"])
+        response = Response(
+            stream_with_context(stream_json_array(messages)), mimetype="application/json"
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -67,23 +167,15 @@ def create_message():
         message_text = data.get("text", "").strip()
         if not message_text:
             return jsonify({"error": "Message text is required"}), 400
-        # Accept provided insights if present, else extract
+        # Accept provided insights if present, else they are extracted in the background
         insights = data.get("insights")
-        if insights is None:
-            insights = generate_insights(message_text)
-        message = {
-            "userID": userID,
-            "text": message_text,
-            "insights": insights,
-            "timestamp": datetime.now().isoformat(),
-        }
-        result = messages_collection.insert_one(message)
-        message_id = str(result.inserted_id)
-        message["_id"] = message_id
-        # Auto-categorize the new message
-        auto_categorize_single_memory(userID, message_id)
+        message_id, job_id = insert_pending_message(userID, message_text, insights, "single", categorize=True,
+                                                     use_cache=not data.get("noCache", False))
+        if job_id is None:
+            return jsonify({"error": "Memory already exists", "id": message_id, "duplicate": True}), 409
         return (
-            jsonify({"message": "Message created successfully", "id": message_id}),
+            jsonify({"message": "Message created successfully", "id": message_id,
+                     "status": "pending", "jobId": job_id}),
             201,
         )
     except Exception as e:
@@ -103,38 +195,61 @@ def add_memories_bulk():
         if not memories or not isinstance(memories, list):
             return jsonify({"error": "memories array is required"}), 400
         
-        get_or_create_user(userID)
-        added_memories = []
+        user = get_or_create_user(userID)
+        use_cache = not data.get("noCache", False)
         
-        for memory_text in memories:
-            if not memory_text or not memory_text.strip():
-                continue
-                
-            # Since these are pre-processed memories, we'll use the text as both text and insights
-            # The insights field will contain the processed memory content
-            message = {
+        # Since these are pre-processed memories, we'll use the text as both text and insights
+        # The insights field will contain the processed memory content
+        new_messages = [
+            {
                 "userID": userID,
                 "text": memory_text.strip(),
                 "insights": memory_text.strip(),
                 "timestamp": datetime.now().isoformat(),
             }
+            for memory_text in memories
+            if isinstance(memory_text, str) and memory_text.strip()
+        ]
+        added_memories = []
+        duplicates = []
+        attach_embeddings(model, new_messages)
+        # Copies of stored memories (or of each other) are skipped before any LLM call
+        incoming = new_messages
+        matches = find_duplicates(userID, incoming, dedupe_index(userID))
+        new_messages = [m for m, match in zip(incoming, matches) if match is None]
+        if new_messages:
+            result = messages_collection.insert_many(new_messages)
+            for message, inserted_id in zip(new_messages, result.inserted_ids):
+                message["_id"] = str(inserted_id)
+            index_new_messages(userID, new_messages)
             
-            result = messages_collection.insert_one(message)
-            message_id = str(result.inserted_id)
-            message["_id"] = message_id
-            
-            # Auto-categorize the new memory
-            auto_categorize_single_memory(userID, message_id)
+            # Auto-categorize the new memories (the LLM calls for ones without a
+            # confident local match run concurrently), then write all folder
+            # memberships at once
+            folders = user.get("folders", [])
+            suggestions = categorize_memories(
+                model, userID, new_messages, folders,
+                lambda memories, fs: categorize_each(memories, fs, use_cache=use_cache),
+            )
+            pairs = []
+            for message in new_messages:
+                suggested_folders = suggestions.get(message["_id"], [])
+                pairs.extend((fid, message["_id"]) for fid in resolve_folder_ids(suggested_folders, folders))
+            add_memberships(userID, pairs)
             
-            added_memories.append({
-                "id": message_id,
-                "text": memory_text.strip()
-            })
+            added_memories = [{"id": m["_id"], "text": m["text"]} for m in new_messages]
+        for message, match in zip(incoming, matches):
+            if match is not None:
+                existing_id = match if isinstance(match, str) else incoming[match]["_id"]
+                duplicates.append({"id": existing_id, "text": message["text"]})
+        mark_seen([m for m in matches if isinstance(m, str)])
         
         return jsonify({
             "message": f"Successfully added {len(added_memories)} memories",
             "added_count": len(added_memories),
-            "memories": added_memories
+            "memories": added_memories,
+            "duplicate_count": len(duplicates),
+            "duplicates": duplicates,
         }), 201
         
     except Exception as e:
@@ -153,23 +268,15 @@ def convert_full_chat_into_memories():
         text = data.get("text", "").strip()
         if not text:
             return jsonify({"error": "Message text is required"}), 400
-        # Accept provided insights if present, else extract
+        # Accept provided insights if present, else they are extracted in the background
         insights = data.get("insights")
-        if insights is None:
-            insights = generate_insights_full_chat(text)
-        message = {
-            "userID": userID,
-            "text": text,
-            "insights": insights,
-            "timestamp": datetime.now().isoformat(),
-        }
-        result = messages_collection.insert_one(message)
-        message_id = str(result.inserted_id)
-        message["_id"] = message_id
-        # Auto-categorize the new message
-        auto_categorize_single_memory(userID, message_id)
+        message_id, job_id = insert_pending_message(userID, text, insights, "full_chat", categorize=True,
+                                                     use_cache=not data.get("noCache", False))
+        if job_id is None:
+            return jsonify({"error": "Memory already exists", "id": message_id, "duplicate": True}), 409
         return (
-            jsonify({"message": "Message created successfully", "id": message_id}),
+            jsonify({"message": "Message created successfully", "id": message_id,
+                     "status": "pending", "jobId": job_id}),
             201,
         )
     except Exception as e:
@@ -189,13 +296,11 @@ def delete_message():
             return jsonify({"error": "id is required"}), 400
         # Remove from messages collection (only if it belongs to the user)
         result = messages_collection.delete_one({"_id": ObjectId(message_id), "userID": userID})
+        if result.deleted_count > 0:
+            unindex_messages(userID, [message_id])
         # Remove from all folders for this user
-        user = get_or_create_user(userID)
-        folders = user.get("folders", [])
-        for folder in folders:
-            if message_id in folder.get("messages", []):
-                folder["messages"].remove(message_id)
-        update_user_folders(userID, folders)
+        get_or_create_user(userID)
+        remove_messages_from_all_folders(userID, [message_id])
         if result.deleted_count > 0:
             return jsonify({"message": "Message deleted successfully"}), 200
         else:
@@ -212,9 +317,11 @@ def get_folders():
         if not userID:
             return jsonify({"error": "userUUID is required"}), 400
         folders = get_user_folders(userID)
-        # Add message counts and ensure description is present
+        message_map = folder_message_map(userID)
+        # Add message ids, counts and ensure description is present
         for folder in folders:
-            folder["messageCount"] = len(folder.get("messages", []))
+            folder["messages"] = message_map.get(folder["folderID"], [])
+            folder["messageCount"] = len(folder["messages"])
             if "description" not in folder:
                 folder["description"] = ""
         return jsonify(folders)
@@ -235,51 +342,30 @@ def create_folder():
             return jsonify({"error": "userUUID is required"}), 400
         if not folder_name:
             return jsonify({"error": "Folder name is required"}), 400
-        user = get_or_create_user(userID)
-        folders = user.get("folders", [])
-        # Check if folder already exists
-        if any(f["name"] == folder_name for f in folders):
-            return jsonify({"error": "Folder already exists"}), 409
+        get_or_create_user(userID)
         folder = {
             "folderID": str(uuid4()),
             "name": folder_name,
             "description": folder_description,
-            "messages": [],
             "created_at": datetime.now().isoformat(),
         }
-        folders.append(folder)
-        update_user_folders(userID, folders)
-        # --- Auto-populate logic ---
+        # Only push the folder if no folder with this name exists (atomic check-and-insert)
+        result = users_collection.update_one(
+            {"userID": userID, "folders.name": {"$ne": folder_name}},
+            {"$push": {"folders": folder}},
+        )
+        if result.matched_count == 0:
+            return jsonify({"error": "Folder already exists"}), 409
+        # --- Auto-populate logic (background job, see autopopulate_folder_job) ---
         if auto_populate:
-            # Fetch all user memories
-            all_memories = list(messages_collection.find({"userID": userID}))
-            # Prepare batches of 10
-            batch_size = 10
-            folder_id = folder["folderID"]
-            memory_id_to_obj = {str(m["_id"]): m for m in all_memories}
-            memory_ids = list(memory_id_to_obj.keys())
-            selected_ids = set()
-            for i in range(0, len(memory_ids), batch_size):
-                batch_ids = memory_ids[i:i+batch_size]
-                batch_memories = [
-                    {"id": mid, "text": memory_id_to_obj[mid].get("text", "")}
-                    for mid in batch_ids
-                ]
-                if not batch_memories:
-                    continue
-                ids_for_folder = batch_autopopulate_memories_to_folder(
-                    folder_name, folder_description, batch_memories
-                )
-                selected_ids.update(ids_for_folder)
-            # Add selected memory IDs to the folder
-            if selected_ids:
-                for f in folders:
-                    if f["folderID"] == folder_id:
-                        for mid in selected_ids:
-                            if mid in memory_id_to_obj and mid not in f["messages"]:
-                                f["messages"].append(mid)
-                        break
-                update_user_folders(userID, folders)
+            job_id = enqueue_job("autopopulate_folder", userID, {
+                "folderID": folder["folderID"],
+                "name": folder_name,
+                "description": folder_description,
+                "useCache": not data.get("noCache", False),
+            })
+            return jsonify({"message": "Folder created successfully", "folderID": folder["folderID"],
+                            "jobId": job_id}), 201
         return jsonify({"message": "Folder created successfully", "folderID": folder["folderID"]}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -296,12 +382,13 @@ def delete_folder():
             return jsonify({"error": "userUUID is required"}), 400
         if not folder_id:
             return jsonify({"error": "Folder ID is required"}), 400
-        user = get_or_create_user(userID)
-        folders = user.get("folders", [])
-        new_folders = [f for f in folders if f["folderID"] != folder_id]
-        if len(new_folders) == len(folders):
+        get_or_create_user(userID)
+        result = users_collection.update_one(
+            {"userID": userID}, {"$pull": {"folders": {"folderID": folder_id}}}
+        )
+        if result.modified_count == 0:
             return jsonify({"error": "Folder not found"}), 500
-        update_user_folders(userID, new_folders)
+        delete_folder_memberships(userID, folder_id)
         return jsonify({"message": "Folder deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -319,18 +406,24 @@ def get_folder_contents(folder_id):
         folder = next((f for f in folders if f["folderID"] == folder_id), None)
         if not folder:
             return jsonify({"error": "Folder not found"}), 500
-        message_ids = folder.get("messages", [])
-        messages = []
-        for message_id in message_ids:
-            try:
-                message = messages_collection.find_one({"_id": ObjectId(message_id), "userID": userID})
-                if message:
-                    message["_id"] = str(message["_id"])
-                    messages.append(message)
-            except Exception as e:
-                print(f"Error finding message with id {message_id}: {e}")
-                continue
-        return jsonify(messages)
+        try:
+            limit = parse_int_param(request.args, "limit", None, minimum=1)
+            offset = parse_int_param(request.args, "offset", 0, minimum=0)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        page_ids = folder_message_ids(
+            userID, folder_id, offset, None if limit is None else min(limit, MAX_PAGE_SIZE)
+        )
+        by_id = fetch_messages_by_ids(userID, page_ids, MESSAGE_PROJECTION)
+        # Keep the order the messages were added to the folder
+        messages = [by_id[mid] for mid in page_ids if mid in by_id]
+        dangling = [mid for mid in page_ids if mid not in by_id]
+        if dangling:
+            remove_from_folder(userID, folder_id, dangling)
+        # The dangling rows are gone, so the memberships after this page moved up
+        # by that many: the next page starts after the messages returned
+        has_more = limit is not None and offset + len(messages) < folder_size(userID, folder_id)
+        return paged_response(messages, offset, has_more)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -358,21 +451,11 @@ def add_message_to_folder(folder_id):
         if not folder:
             return jsonify({"error": "Folder not found"}), 500
         if message_text:
-            # Create new message, use provided insights if present
-            if insights is None:
-                insights = generate_insights(message_text)
-            message = {
-                "userID": userID,
-                "text": message_text,
-                "insights": insights,
-                "timestamp": datetime.now().isoformat(),
-            }
-            result = messages_collection.insert_one(message)
-            message_id = str(result.inserted_id)
+            # Create new message, use provided insights if present (else extracted in the background)
+            message_id, _ = insert_pending_message(userID, message_text, insights, "single", categorize=False,
+                                                   use_cache=not data.get("noCache", False))
         # Add to folder
-        if message_id not in folder["messages"]:
-            folder["messages"].append(message_id)
-        update_user_folders(userID, folders)
+        add_to_folder(userID, folder_id, [message_id])
         return (
             jsonify({"message": "Message added to folder successfully", "id": message_id}),
             200,
@@ -400,9 +483,7 @@ def remove_message_from_folder():
         folder = next((f for f in folders if f["folderID"] == folder_id), None)
         if not folder:
             return jsonify({"error": "Folder not found"}), 500
-        if message_id in folder["messages"]:
-            folder["messages"].remove(message_id)
-        update_user_folders(userID, folders)
+        remove_from_folder(userID, folder_id, [message_id])
         return jsonify({"message": "Message removed from folder successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -410,7 +491,7 @@ def remove_message_from_folder():
 
 @app.route("/api/search", methods=["POST"])
 def search_messages():
-    """Search messages using semantic search for a user"""
+    """Search a user's messages by meaning, by exact terms (BM25), or both"""
     try:
         data = request.json
         userID = data.get("userUUID")
@@ -419,51 +500,64 @@ def search_messages():
             return jsonify([])
         if not query:
             return jsonify([])
-        # Get all messages for this user
-        messages = list(messages_collection.find({"userID": userID}))
-        for message in messages:
-            message["_id"] = str(message["_id"])
-        if not messages:
-            return jsonify([])
-        if model:
-            # Semantic search
-            query_embedding = model.encode([query])
-            message_texts = []
-            for msg in messages:
-                text = msg.get("text", "")
-                insights = msg.get("insights", [])
-                if insights:
-                    text += (
-                        " " + " ".join(insights)
-                        if isinstance(insights, list)
-                        else " " + insights
-                    )
-                message_texts.append(text)
-            message_embeddings = model.encode(message_texts)
-            similarities = cosine_similarity(query_embedding, message_embeddings)[0]
-            for i, msg in enumerate(messages):
-                msg["similarity"] = float(similarities[i])
-            messages.sort(key=lambda x: x["similarity"], reverse=True)
-            threshold = 0.05  # 5% similarity threshold
-            filtered_messages = [
-                msg for msg in messages if msg["similarity"] >= threshold
-            ]
-            return jsonify(filtered_messages)
+        # Paging: top_k results starting at offset (ANN search when top_k is set)
+        try:
+            top_k = parse_int_param(data, "top_k", None, minimum=1)
+            offset = parse_int_param(data, "offset", 0, minimum=0)
+            min_similarity = float(data.get("min_similarity", DEFAULT_MIN_SIMILARITY))
+            # compact: only return ids, scores and insights
+            compact = parse_bool_param(data, "compact", False)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        mode = data.get("mode", "hybrid")
+        if mode not in SEARCH_MODES:
+            return jsonify({"error": f"mode must be one of {', '.join(SEARCH_MODES)}"}), 400
+        # Filters narrow the candidates before anything is scored
+        try:
+            candidates = search_candidates(userID, data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if candidates is not None and not candidates:
+            return paged_response([], offset, False)
+        # Until the model is loaded (or if it failed) only the lexical ranker is
+        # available; don't block the search on the load, start it instead
+        if model.model is None:
+            model.load_in_background()
+            mode = "lexical"
+        projection = {"insights": 1} if compact else MESSAGE_PROJECTION
+        # Fetch one extra hit to know whether there is a next page
+        window = None if top_k is None else offset + top_k + 1
+        if mode == "lexical":
+            lexical = get_user_lexical_index(userID).search(query, window, ids=candidates)
+            hits = [(mid, {"score": score}) for mid, score in lexical]
         else:
-            # Fallback to text search
-            query_lower = query.lower()
-            results = []
-            for msg in messages:
-                text = msg.get("text", "").lower()
-                insights = msg.get("insights", [])
-                if insights:
-                    if isinstance(insights, list):
-                        text += " " + " ".join(insights).lower()
-                    else:
-                        text += " " + insights.lower()
-                if query_lower in text:
-                    results.append(msg)
-            return jsonify(results)
+            # Only the query is encoded, message vectors come from the user's in-memory index
+            index = get_user_vector_index(userID)
+            query_embedding = model.encode([query])[0]
+            if mode == "semantic":
+                semantic = index.search(query_embedding, window, min_score=min_similarity, ids=candidates)
+                hits = [(mid, {"similarity": score}) for mid, score in semantic]
+            else:
+                depth = None if window is None else window * HYBRID_CANDIDATE_FACTOR
+                semantic = index.search(query_embedding, depth, min_score=min_similarity, ids=candidates)
+                lexical = get_user_lexical_index(userID).search(query, depth, ids=candidates)
+                fused = reciprocal_rank_fusion([semantic, lexical])[:window]
+                # Exact-term matches outside the semantic candidates still get their cosine similarity
+                similarity = dict(semantic)
+                similarity.update(index.score_ids(query_embedding, [mid for mid, _ in fused if mid not in similarity]))
+                hits = [(mid, {"score": score, "similarity": similarity.get(mid)}) for mid, score in fused]
+        has_more = top_k is not None and len(hits) > offset + top_k
+        hits = hits[offset:] if top_k is None else hits[offset:offset + top_k]
+        if not hits:
+            return paged_response([], offset, has_more)
+        by_id = fetch_messages_by_ids(userID, [mid for mid, _ in hits], projection)
+        results = []
+        for mid, scores in hits:
+            msg = by_id.get(mid)
+            if msg:
+                msg.update(scores)
+                results.append(msg)
+        return paged_response(results, offset, has_more, len(hits))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -478,12 +572,12 @@ def clear_all_user_data():
             return jsonify({"error": "userUUID is required"}), 400
         # Delete all messages for this user
         msg_result = messages_collection.delete_many({"userID": userID})
+        bump_messages_version(userID)
+        vector_indexes.invalidate(userID)
+        lexical_indexes.invalidate(userID)
         # Delete all messages from all folders for this user
-        user = get_or_create_user(userID)
-        folders = user.get("folders", [])
-        for folder in folders:
-            folder["messages"] = []
-        update_user_folders(userID, folders)
+        get_or_create_user(userID)
+        clear_memberships(userID)
         return jsonify({
             "message": "All messages deleted successfully",
             "deletedMessages": msg_result.deleted_count,
@@ -491,123 +585,49 @@ def clear_all_user_data():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def generate_insights_with_claude(message_text):
-    """Generate insights from message text using Claude 3.5 Haiku (Anthropic Messages API)"""
-    try:
-        if not os.getenv("ANTHROPIC_API_KEY"):
-            raise Exception("Anthropic API key not configured")
-
-        prompt = PROMPT.format(message_text=message_text)
-        response = anthropic_client.messages.create(
-            model="claude-3-5-haiku-latest",
-            max_tokens=800,
-            temperature=0.3,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        # Extract text from content blocks
-        content = ""
-        for block in response.content:
-            if block.type == "text":
-                content += block.text
-        content = content.strip()
-        if not content:
-            raise Exception("No response content received")
-
-        # Parse the JSON response
-        try:
-            parsed_response = json.loads(content)
-            # Handle the response format with "memories" key
-            if (
-                parsed_response
-                and parsed_response.get("memories")
-                and isinstance(parsed_response["memories"], list)
-            ):
-                insights = parsed_response["memories"]
-            elif isinstance(parsed_response, list):
-                # Fallback for old format where response was directly an array
-                insights = parsed_response
-            else:
-                raise Exception("Invalid response format - expected memories array")
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract insights from plain text
-            insights = parse_insights_from_text(content)
-
-        # Validate insights
-        if not isinstance(insights, list):
-            raise Exception("Invalid insights format")
-
-        # Ensure we have 3 or fewer insights
-        insights = insights[:3]
-
-        # Filter out empty or invalid insights
-        insights = [
-            insight
-            for insight in insights
-            if insight and isinstance(insight, str) and insight.strip()
-        ]
 
-        if not insights:
-            raise Exception("No valid insights extracted")
+@app.route("/health", methods=["GET"])
+@app.route("/health/live", methods=["GET"])
+def health_check():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({"status": "healthy", "message": "Backend is running"})
 
-        return insights
 
+@app.route("/health/ready", methods=["GET"])
+def readiness_check():
+    """Readiness: MongoDB is reachable, its indexes are built and the embedding model has finished loading"""
+    checks = {"model": model.state, "indexes": index_bootstrap.state}
+    try:
+        mongo_client.admin.command("ping")
+        checks["mongo"] = "ok"
     except Exception as e:
-        print(f"Error generating insights: {e}")
-        # Return a default insight if Claude fails
-        return [f"Important message: {message_text[:100]}..."]
-
-
-def parse_insights_from_text(text):
-    """Parse insights from plain text if JSON parsing fails"""
-    lines = text.split("\n")
-    insights = []
-
-    for line in lines:
-        line = line.strip()
-        # Look for bullet points, numbered items, or lines that start with common insight indicators
-        if (
-            line.startswith("-")
-            or line.startswith("•")
-            or line.startswith("*")
-            or line[0].isdigit()
-            and ". " in line
-            or line.lower().startswith("insight")
-            or line.lower().startswith("key")
-            or line.lower().startswith("point")
-        ):
-
-            # Clean up the line
-            insight = line
-            if insight.startswith(("-", "•", "*")):
-                insight = insight[1:].strip()
-            elif insight[0].isdigit() and ". " in insight:
-                insight = insight.split(". ", 1)[1]
-            elif insight.lower().startswith("insight"):
-                insight = insight[8:].strip()
-            elif insight.lower().startswith("key"):
-                insight = insight[3:].strip()
-            elif insight.lower().startswith("point"):
-                insight = insight[5:].strip()
-
-            if insight and len(insight) > 0:
-                insights.append(insight)
-
-    # If no structured insights found, take the first few meaningful lines
-    if not insights:
-        meaningful_lines = [
-            line.strip()
-            for line in lines
-            if len(line.strip()) > 10 and len(line.strip()) < 200
-        ]
-        insights = meaningful_lines[:3]
+        checks["mongo"] = str(e)
+    if not model.ready or checks["mongo"] != "ok" or index_bootstrap.state == "building":
+        return jsonify({"status": "not ready", **checks}), 503
+    # Without the model (or an index) the backend still serves everything, with
+    # text search (or slower queries)
+    status = "ready" if model.model is not None and index_bootstrap.state == "ok" else "degraded"
+    if index_bootstrap.error:
+        checks["indexError"] = index_bootstrap.error
+    return jsonify({"status": status, **checks}), 200
 
-    return insights
 
+@app.route("/api/metrics/categorization", methods=["GET"])
+def get_categorization_metrics():
+    """How many memories were categorized by the embedding pre-filter vs. the LLM (this process)"""
+    return jsonify(categorization_metrics.snapshot())
 
-@app.route("/health", methods=["GET"])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({"status": "healthy", "message": "Backend is running"})
+
+@app.route("/api/metrics/llm-cache", methods=["GET"])
+def get_llm_cache_metrics():
+    """LLM result cache hits and misses (this process)"""
+    return jsonify(llm_cache.stats())
+
+
+@app.route("/api/metrics/embeddings", methods=["GET"])
+def get_embedding_metrics():
+    """Embedding model state, queue depth and batch sizes (this process)"""
+    return jsonify(model.stats())
 
 
 @app.route("/api/auto-categorize-memories", methods=["POST"])
@@ -621,21 +641,27 @@ def auto_categorize_memories():
         user = get_or_create_user(userID)
         folders = user.get("folders", [])
         # Build a set of all message IDs already in folders
-        categorized_ids = set()
-        for folder in folders:
-            categorized_ids.update(folder.get("messages", []))
+        categorized_ids = categorized_message_ids(userID)
         # Get all messages for the user
-        messages = list(messages_collection.find({"userID": userID}))
+        messages = list(messages_collection.find({"userID": userID}, {"_id": 1}))
         # Find uncategorized messages
-        uncategorized = [m for m in messages if str(m["_id"]) not in categorized_ids]
+        uncategorized = [str(m["_id"]) for m in messages if str(m["_id"]) not in categorized_ids]
         if not uncategorized:
             return jsonify({"message": "No uncategorized memories found."}), 200
+        by_id = fetch_messages_by_ids(userID, uncategorized, {"text": 1, "embedding": 1})
+        use_cache = not data.get("noCache", False)
+        # Many memories per LLM call, then one bulk write for every folder update
+        suggestions = categorize_memories(
+            model, userID, list(by_id.values()), folders,
+            lambda memories, fs: batch_categorize_memories(memories, fs, use_cache=use_cache),
+        )
+        pairs = []
         updated = set()
-        for mem in uncategorized:
-            mem_id = str(mem["_id"])
-            success, msg = auto_categorize_single_memory(userID, mem_id)
-            if success:
+        for mem_id, suggested_folders in suggestions.items():
+            for fid in resolve_folder_ids(suggested_folders, folders):
+                pairs.append((fid, mem_id))
                 updated.add(mem_id)
+        add_memberships(userID, pairs)
         return jsonify({
             "message": f"Categorized {len(updated)} memories.",
             "categorized": list(updated)
@@ -673,51 +699,502 @@ def get_or_create_user(userID):
                 "folderID": str(uuid4()),
                 "name": f["name"],
                 "description": f["description"],
-                "messages": [],
                 "created_at": datetime.now().isoformat(),
             }
             for f in default_folders
         ]
         user = {"userID": userID, "folders": folders}
-        users_collection.insert_one(user)
+        try:
+            users_collection.insert_one(user)
+        except DuplicateKeyError:
+            # Created by a concurrent request; the unique userID index keeps one copy
+            pass
+        user = users_collection.find_one({"userID": userID})
+    elif migrate_user_memberships(user):
+        # Folder ids still stored in the legacy embedded arrays were just moved out
         user = users_collection.find_one({"userID": userID})
     return user
 
+# --- Request Utilities ---
+def parse_int_param(data, name, default, minimum=None):
+    """Read an integer parameter from a request dict, raising ValueError if invalid"""
+    value = data.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+def parse_bool_param(data, name, default):
+    """Read a JSON boolean parameter from a request dict, raising ValueError if it is anything else"""
+    value = data.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, bool):
+        raise ValueError(f"{name} must be true or false")
+    return value
+
+def stream_json_array(messages):
+    """Yield messages as a JSON array one document at a time, so large results are never held in memory"""
+    yield "["
+    for i, message in enumerate(messages):
+        message["_id"] = str(message["_id"])
+        yield ("," if i else "") + json.dumps(message, default=str)
+    yield "]"
+
+def paged_response(results, offset, has_more, consumed=None):
+    """
+    JSON list of a page of results, with the next page's offset in X-Next-Offset.
+    `consumed` is how many positions this page covered, if not len(results).
+    """
+    response = jsonify(results)
+    if has_more:
+        consumed = len(results) if consumed is None else consumed
+        response.headers["X-Next-Offset"] = str(offset + consumed)
+    return response
+
+# --- Message Utilities ---
+FETCH_CHUNK_SIZE = 500
+
+def search_candidates(userID, data):
+    """
+    Ids of the user's messages matching the search filters in `data`, or None
+    if no filter is set:
+      folderId - messages in this folder (from the folder memberships)
+      since    - messages with a timestamp after this ISO datetime
+      until    - messages with a timestamp before this ISO datetime
+      imported - true for messages imported from a conversations.json export, false for the rest
+    Raises ValueError for a malformed filter.
+    """
+    query = {}
+    for param, operator in (("since", "$gt"), ("until", "$lt")):
+        value = data.get(param)
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{param} must be an ISO datetime")
+            query.setdefault("timestamp", {})[operator] = value
+    imported = data.get("imported")
+    if imported is not None:
+        if not isinstance(imported, bool):
+            raise ValueError("imported must be true or false")
+        query["importJobId"] = {"$exists": imported}
+    folder_id = data.get("folderId")
+    if folder_id:
+        folder_ids = folder_message_ids(userID, folder_id)
+        if not query:
+            return folder_ids
+        query["_id"] = {"$in": [ObjectId(mid) for mid in folder_ids if ObjectId.is_valid(mid)]}
+    elif not query:
+        return None
+    # A timestamp range is served by the (userID, timestamp) index
+    query["userID"] = userID
+    return [str(m["_id"]) for m in messages_collection.find(query, {"_id": 1})]
+
+def fetch_messages_by_ids(userID, message_ids, projection=None):
+    """
+    Fetch a user's messages by id with one $in query per FETCH_CHUNK_SIZE ids.
+    Returns {id: message} with string _ids; unknown or invalid ids are left out.
+    """
+    object_ids = [ObjectId(mid) for mid in message_ids if ObjectId.is_valid(mid)]
+    by_id = {}
+    for i in range(0, len(object_ids), FETCH_CHUNK_SIZE):
+        chunk = object_ids[i:i + FETCH_CHUNK_SIZE]
+        for message in messages_collection.find({"_id": {"$in": chunk}, "userID": userID}, projection):
+            message["_id"] = str(message["_id"])
+            by_id[message["_id"]] = message
+    return by_id
+
+# --- Vector Index Utilities ---
+def get_user_vector_index(userID):
+    """Get the user's vector index, rebuilding it if their messages changed since it was built (in any process)"""
+    return vector_indexes.get(userID, messages_version(userID))
+
+def dedupe_index(userID):
+    """The vector index that incoming memories are checked against, or None if that check is off"""
+    if not DEDUPE_ON_INGEST or not model:
+        return None
+    return get_user_vector_index(userID)
+
+def get_user_lexical_index(userID):
+    """Get the user's BM25 index, rebuilding it if their messages changed since it was built (in any process)"""
+    return lexical_indexes.get(userID, messages_version(userID))
+
+def index_new_messages(userID, messages):
+    """
+    Record freshly written messages: bump the user's messages version and add
+    them to the BM25 index and (with embeddings) the vector index
+    """
+    version = bump_messages_version(userID)
+    lexical_indexes.add(userID, [str(m["_id"]) for m in messages], [build_embedding_text(m) for m in messages], version)
+    embedded = [m for m in messages if m.get("embedding")]
+    vectors = embedding_matrix([m["embedding"] for m in embedded]) if embedded else None
+    # Messages without an embedding are missing from the vector index, so leave it stale to be rebuilt
+    vector_indexes.add(userID, [str(m["_id"]) for m in embedded], vectors, version if len(embedded) == len(messages) else None)
+
+def unindex_messages(userID, message_ids):
+    """Record deleted messages: bump the user's messages version and drop them from both indexes"""
+    version = bump_messages_version(userID)
+    for message_id in message_ids:
+        vector_indexes.remove(userID, message_id, version)
+        lexical_indexes.remove(userID, message_id, version)
+
 def get_user_folders(userID):
     user = get_or_create_user(userID)
     return user.get("folders", [])
 
-def update_user_folders(userID, folders):
-    users_collection.update_one({"userID": userID}, {"$set": {"folders": folders}})
-
-def auto_categorize_single_memory(userID, message_id):
+def auto_categorize_single_memory(userID, message_id, use_cache=True):
     """Auto-categorize a single memory for a user using the LLM"""
     user = get_or_create_user(userID)
     folders = user.get("folders", [])
-    folder_name_to_id = {f["name"]: f["folderID"] for f in folders}
-    folder_name_to_obj = {f["name"]: f for f in folders}
     misc_folder = next((f for f in folders if f["name"].lower() == "misc"), None)
     if not misc_folder:
         return False, "Misc folder not found for user."
     # Get the message
-    mem = messages_collection.find_one({"_id": ObjectId(message_id), "userID": userID})
+    mem = messages_collection.find_one({"_id": ObjectId(message_id), "userID": userID}, {"text": 1, "embedding": 1})
     if not mem:
         return False, "Message not found."
     mem_id = str(mem["_id"])
-    mem_text = mem.get("text", "")
-    suggested_folders = categorize_memory_to_folders(mem_text, folders)
-    updated = False
-    for fname in suggested_folders:
-        folder = folder_name_to_obj.get(fname)
-        if not folder:
-            folder = misc_folder
-        if mem_id not in folder["messages"]:
-            folder["messages"].append(mem_id)
-            updated = True
-    if updated:
-        update_user_folders(userID, folders)
+    # Confident embedding matches skip the LLM
+    suggested_folders = categorize_memory(
+        model, userID, mem, folders,
+        lambda text, fs: categorize_memory_to_folders(text, fs, use_cache=use_cache),
+    )
+    folder_ids = resolve_folder_ids(suggested_folders, folders)
+    updated = add_memberships(userID, [(fid, mem_id) for fid in folder_ids]) > 0
     return True, "Categorized." if updated else "No folder updated."
 
+def resolve_folder_ids(suggested_folders, folders):
+    """Map folder names suggested by the LLM to folder ids; unknown names go to Misc"""
+    folder_name_to_obj = {f["name"]: f for f in folders}
+    misc_folder = next((f for f in folders if f["name"].lower() == "misc"), None)
+    folder_ids = []
+    for fname in suggested_folders:
+        folder = folder_name_to_obj.get(fname) or misc_folder
+        if folder and folder["folderID"] not in folder_ids:
+            folder_ids.append(folder["folderID"])
+    return folder_ids
+
+# --- Background Jobs ---
+def insert_pending_message(userID, text, insights, insight_mode, categorize, use_cache=True):
+    """
+    Store a message right away and queue a job that extracts its insights (when
+    none were provided) and auto-categorizes it. The message has status
+    "pending" until the job finishes. With use_cache=False the job skips cached
+    LLM results. Returns (message_id, job_id); if the text duplicates a stored
+    memory nothing is stored or queued and (existing_id, None) is returned.
+    Near-duplicates of a message without insights are only caught by the job,
+    once its embedding includes the extracted insights like the stored ones.
+    """
+    message = {
+        "userID": userID,
+        "text": text,
+        "insights": insights,
+        "timestamp": datetime.now().isoformat(),
+        "status": "pending",
+    }
+    attach_embeddings(model, [message])
+    # Without insights yet, the embedding isn't comparable to stored ones: exact copies only
+    index = dedupe_index(userID) if insights is not None else None
+    duplicate_of = find_duplicates(userID, [message], index)[0]
+    if duplicate_of is not None:
+        mark_seen([duplicate_of])
+        return duplicate_of, None
+    result = messages_collection.insert_one(message)
+    message_id = str(result.inserted_id)
+    message["_id"] = message_id
+    index_new_messages(userID, [message])
+    job_id = enqueue_job("process_message", userID, {
+        "messageId": message_id,
+        "insightMode": insight_mode if insights is None else None,
+        "categorize": categorize,
+        "useCache": use_cache,
+    })
+    messages_collection.update_one({"_id": result.inserted_id}, {"$set": {"jobId": job_id}})
+    return message_id, job_id
+
+def fail_pending_message(job):
+    """The message's job gave up: mark the message failed instead of leaving it pending"""
+    messages_collection.update_one(
+        {"_id": ObjectId(job["payload"]["messageId"]), "userID": job["userID"]}, {"$set": {"status": "failed"}}
+    )
+
+@job_handler("process_message", on_failure=fail_pending_message)
+def process_message_job(job):
+    """
+    Fill in a pending message's insights (and embedding), then auto-categorize
+    it. If it turns out to be a near-duplicate of a stored memory, it is merged
+    into that memory (folder memberships moved, message deleted) instead.
+    """
+    userID = job["userID"]
+    payload = job["payload"]
+    message_id = payload["messageId"]
+    message = messages_collection.find_one({"_id": ObjectId(message_id), "userID": userID})
+    if not message:
+        return {"skipped": "Message not found"}
+    use_cache = payload.get("useCache", True)
+    if payload.get("insightMode") and message.get("insights") is None:
+        if payload["insightMode"] == "full_chat":
+            message["insights"] = generate_insights_full_chat(message["text"], use_cache=use_cache)
+        else:
+            message["insights"] = generate_insights(message["text"], use_cache=use_cache)
+        # Insights are part of the embedded text, so re-embed
+        attach_embeddings(model, [message])
+        update = {"insights": message["insights"]}
+        update.update({field: message[field] for field in EMBEDDING_FIELDS if field in message})
+        messages_collection.update_one({"_id": message["_id"]}, {"$set": update})
+        message["_id"] = message_id
+        index_new_messages(userID, [message])
+        duplicate_of = find_stored_near_duplicate(message, dedupe_index(userID))
+        if duplicate_of is not None:
+            merge_duplicates(userID, {message_id: duplicate_of})
+            unindex_messages(userID, [message_id])
+            mark_seen([duplicate_of])
+            return {"messageId": message_id, "duplicateOf": duplicate_of}
+    categorized = False
+    if payload.get("categorize"):
+        categorized, _ = auto_categorize_single_memory(userID, message_id, use_cache=use_cache)
+    messages_collection.update_one({"_id": ObjectId(message_id)}, {"$set": {"status": "ready"}})
+    return {"messageId": message_id, "categorized": categorized}
+
+@job_handler("autopopulate_folder")
+def autopopulate_folder_job(job):
+    """
+    Let the LLM pick which of the user's memories belong in a new folder.
+    Memories are sent in token-budgeted batches, LLM_CONCURRENCY batches at a
+    time. Progress (last memory _id processed) is saved after every wave, so a
+    retried job continues where the previous attempt stopped.
+    """
+    userID = job["userID"]
+    payload = job["payload"]
+    folder_id = payload["folderID"]
+    progress = job.get("progress", {})
+    done = progress.get("done", 0)
+    added = progress.get("added", 0)
+    query = {"userID": userID}
+    if progress.get("lastMessageId"):
+        query["_id"] = {"$gt": ObjectId(progress["lastMessageId"])}
+    total = done + messages_collection.count_documents(query)
+    memories = (
+        {"id": str(m["_id"]), "text": m.get("text", "")}
+        for m in messages_collection.find(query, {"text": 1}).sort("_id", 1)
+    )
+    batches = batch_by_token_budget(memories, AUTOPOPULATE_TOKEN_BUDGET, AUTOPOPULATE_MAX_BATCH)
+    while True:
+        wave = list(islice(batches, LLM_CONCURRENCY))
+        if not wave:
+            break
+        results = map_concurrently(
+            lambda batch: abatch_autopopulate_memories_to_folder(
+                payload["name"], payload["description"], batch, use_cache=payload.get("useCache", True)
+            ),
+            wave,
+        )
+        selected = []
+        for batch, ids_for_folder in zip(wave, results):
+            # Only accept ids that were actually in the batch
+            batch_ids = [m["id"] for m in batch]
+            chosen = set(ids_for_folder)
+            selected.extend(mid for mid in batch_ids if mid in chosen)
+        added += add_to_folder(userID, folder_id, selected)
+        done += sum(len(batch) for batch in wave)
+        update_job_progress(job, lastMessageId=wave[-1][-1]["id"], done=done, total=total, added=added)
+    return {"folderID": folder_id, "processed": done, "added": added}
+
+@app.route("/api/import/conversations", methods=["POST"])
+def import_conversations():
+    """
+    Import a ChatGPT conversations.json export. The file is sent either as the
+    raw request body or as a multipart "file" field, and is streamed into
+    GridFS without being parsed or held in memory; a background job then
+    turns each conversation into a memory.
+    """
+    try:
+        userID = request.args.get("userUUID") or request.form.get("userUUID")
+        if not userID:
+            return jsonify({"error": "userUUID is required"}), 400
+        get_or_create_user(userID)
+        upload = request.files.get("file")
+        source = upload.stream if upload else request.stream
+        filename = upload.filename if upload else "conversations.json"
+        file_id = imports_bucket.upload_from_stream(filename, source, metadata={"userID": userID})
+        job_id = enqueue_job("import_conversations", userID, {
+            "fileId": str(file_id),
+            "useCache": request.args.get("noCache", "false").lower() != "true",
+        })
+        return jsonify({"message": "Import started", "jobId": job_id}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def delete_import_upload(job):
+    """Delete the uploaded export once its import job has finished or finally failed"""
+    try:
+        imports_bucket.delete(ObjectId(job["payload"]["fileId"]))
+    except NoFile:
+        pass
+
+@job_handler("import_conversations", on_failure=delete_import_upload, queue="imports")
+def import_conversations_job(job):
+    """
+    Turn each conversation of an uploaded export into a memory (transcript as
+    text, extracted insights), auto-categorized. Conversations are parsed one
+    at a time and processed IMPORT_CONCURRENCY at a time; progress is saved
+    after every wave, so a retried job skips what was already imported.
+    Conversations that duplicate a stored memory are counted and skipped.
+    """
+    userID = job["userID"]
+    payload = job["payload"]
+    use_cache = payload.get("useCache", True)
+    file_id = ObjectId(payload["fileId"])
+    progress = job.get("progress", {})
+    done = progress.get("done", 0)
+    imported = progress.get("imported", 0)
+    skipped = progress.get("skipped", 0)
+    duplicates = progress.get("duplicates", 0)
+    folders = get_user_folders(userID)
+    with imports_bucket.open_download_stream(file_id) as stream:
+        conversations = iter_conversations(stream, skip=done)
+        while True:
+            batch = list(islice(conversations, IMPORT_CONCURRENCY))
+            if not batch:
+                break
+            wave = []
+            for index, conversation in batch:
+                transcript = conversation_transcript(conversation)
+                if transcript:
+                    wave.append((index, transcript, conversation_timestamp(conversation)))
+                else:
+                    skipped += 1
+            added, duplicated = import_conversation_wave(job, userID, wave, folders, use_cache)
+            imported += added
+            duplicates += duplicated
+            done = batch[-1][0] + 1
+            update_job_progress(job, done=done, imported=imported, skipped=skipped, duplicates=duplicates,
+                                bytesRead=stream.tell(), totalBytes=stream.length)
+    delete_import_upload(job)
+    return {"conversations": done, "imported": imported, "skipped": skipped, "duplicates": duplicates}
+
+def import_conversation_wave(job, userID, wave, folders, use_cache):
+    """
+    Extract, store, index and categorize one wave of (index, transcript,
+    timestamp). Returns (how many were added, how many were duplicates).
+    """
+    # A previous attempt may have stored part of this wave before it was
+    # interrupted, possibly before categorizing it
+    stored = list(messages_collection.find(
+        {"importJobId": str(job["_id"]), "importIndex": {"$in": [index for index, _, _ in wave]}},
+        {"importIndex": 1, "text": 1, "embedding": 1},
+    ))
+    existing = {m["importIndex"] for m in stored}
+    categorized = categorized_message_ids(userID, [str(m["_id"]) for m in stored])
+    uncategorized = [m for m in stored if str(m["_id"]) not in categorized]
+    candidates = [
+        {
+            "userID": userID,
+            "text": transcript,
+            "timestamp": timestamp,
+            "importJobId": str(job["_id"]),
+            "importIndex": index,
+        }
+        for index, transcript, timestamp in wave
+        if index not in existing
+    ]
+    # Drop exact copies of stored memories before extracting insights
+    matches = find_duplicates(userID, candidates)
+    mark_seen([m for m in matches if isinstance(m, str)])
+    new_messages = [m for m, match in zip(candidates, matches) if match is None]
+    duplicated = len(candidates) - len(new_messages)
+    if not new_messages:
+        categorize_import_wave(userID, uncategorized, folders, use_cache)
+        return 0, duplicated
+    insights = map_concurrently(
+        lambda m: agenerate_insights_full_chat(m["text"], use_cache), new_messages, IMPORT_CONCURRENCY
+    )
+    for message, message_insights in zip(new_messages, insights):
+        message["insights"] = message_insights
+    # Embedded with their insights, like the stored memories, so near-duplicates can be dropped now
+    attach_embeddings(model, new_messages)
+    matches = find_duplicates(userID, new_messages, dedupe_index(userID))
+    mark_seen([m for m in matches if isinstance(m, str)])
+    kept = [m for m, match in zip(new_messages, matches) if match is None]
+    duplicated += len(new_messages) - len(kept)
+    new_messages = kept
+    if not new_messages:
+        categorize_import_wave(userID, uncategorized, folders, use_cache)
+        return 0, duplicated
+    result = messages_collection.insert_many(new_messages)
+    for message, inserted_id in zip(new_messages, result.inserted_ids):
+        message["_id"] = str(inserted_id)
+    index_new_messages(userID, new_messages)
+    categorize_import_wave(userID, uncategorized + new_messages, folders, use_cache)
+    return len(new_messages), duplicated
+
+def categorize_import_wave(userID, messages, folders, use_cache):
+    """Auto-categorize imported messages and write their folder memberships at once"""
+    if not messages:
+        return
+    suggestions = categorize_memories(
+        model, userID, messages, folders,
+        lambda memories, fs: categorize_each(memories, fs, use_cache=use_cache),
+    )
+    pairs = []
+    for message in messages:
+        message_id = str(message["_id"])
+        pairs.extend((fid, message_id) for fid in resolve_folder_ids(suggestions.get(message_id, []), folders))
+    add_memberships(userID, pairs)
+
+@app.route("/api/messages/compact", methods=["POST"])
+def compact_messages():
+    """Queue a job that merges the user's duplicate memories"""
+    try:
+        data = request.json
+        userID = data.get("userUUID")
+        if not userID:
+            return jsonify({"error": "userUUID is required"}), 400
+        get_or_create_user(userID)
+        job_id = enqueue_job("compact_duplicates", userID, {})
+        return jsonify({"message": "Compaction started", "jobId": job_id}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@job_handler("compact_duplicates")
+def compact_duplicates_job(job):
+    """
+    Collapse duplicate memories onto the oldest copy: folder memberships are
+    moved to the kept memory and the duplicates are deleted and unindexed.
+    """
+    userID = job["userID"]
+    index = get_user_vector_index(userID) if model else None
+    keep_for = find_stored_duplicates(userID, index)
+    update_job_progress(job, duplicates=len(keep_for))
+    removed = merge_duplicates(userID, keep_for)
+    if keep_for:
+        unindex_messages(userID, keep_for)
+    invalidate_centroids(userID)
+    return {"removed": removed}
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """Poll the status and progress of a background job"""
+    try:
+        userID = request.args.get("userUUID")
+        if not userID:
+            return jsonify({"error": "userUUID is required"}), 400
+        job = get_job(userID, job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(serialize_job(job)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/api/extract-insight", methods=["POST"])
 def extract_insight():
     """Extract insight from multiple messages with optional custom prompt"""
@@ -734,59 +1211,34 @@ def extract_insight():
         combined_text = "\n".join(messages)
         if prompt:
             combined_text += f"\n\n[User instructions: {prompt}]"
-        # Use the new multi-message insight function
-        insight = generate_multi_message_insight_with_claude(combined_text)
+        insight = generate_multi_message_insight(combined_text, use_cache=not data.get("noCache", False))
         return jsonify({"insights": [insight]}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def generate_multi_message_insight_with_claude(messages_text):
-    """Generate a single synthesized insight from multiple messages using Claude and PROMPT_MULTI."""
-    try:
-        if not os.getenv("ANTHROPIC_API_KEY"):
-            raise Exception("Anthropic API key not configured")
-
-        prompt = PROMPT_MULTI.format(message_text=messages_text)
-        response = anthropic_client.messages.create(
-            model="claude-3-5-haiku-latest",
-            max_tokens=800,
-            temperature=0.3,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        # Extract text from content blocks
-        content = ""
-        for block in response.content:
-            if block.type == "text":
-                content += block.text
-        content = content.strip()
-        if not content:
-            raise Exception("No response content received")
-        # Parse the JSON response
-        try:
-            parsed_response = json.loads(content)
-            if parsed_response and isinstance(parsed_response, dict) and "memories" in parsed_response:
-                memories = parsed_response["memories"]
-                if isinstance(memories, list):
-                    # Join the list into a single string for the return value
-                    insight = "\n".join(memories)
-                else:
-                    raise Exception("Invalid response format - 'memories' is not a list")
-            else:
-                raise Exception("Invalid response format - expected 'memories' key")
-        except json.JSONDecodeError:
-            # If JSON parsing fails, just use the raw text
-            insight = content
-        # Validate
-        if not insight or not isinstance(insight, str) or not insight.strip():
-            raise Exception("No valid insight extracted")
-        return insight.strip()
-    except Exception as e:
-        print(e)
-        print(f"Error generating multi-message insight: {e}")
-        return f"Important insight: {messages_text[:100]}..."
+# Background workers for queued jobs (JOB_WORKERS=0 disables them in this
+# process), and for import jobs on their own queue
+job_workers = JobWorkerPool()
+import_workers = JobWorkerPool(IMPORT_JOB_WORKERS, queue="imports")
+
+
+def start_background_threads():
+    """Job workers, and creating the MongoDB indexes (userID lookups on every route)"""
+    index_bootstrap.start()
+    if JOB_WORKERS > 0:
+        job_workers.start()
+    if IMPORT_JOB_WORKERS > 0:
+        import_workers.start()
+
+
+# Threads don't survive a fork, so gunicorn.conf.py turns this off and starts
+# them in each worker process instead
+if os.getenv("BACKGROUND_THREADS_ON_IMPORT", "true").lower() == "true" and not RELOADER_PARENT:
+    start_background_threads()
 
 
 if __name__ == "__main__":
+    # Development server; see gunicorn.conf.py for production
     port = int(os.getenv("PORT", 3000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=FLASK_DEBUG)
@@ -0,0 +1,83 @@
+"""
+Backfill stored embeddings for existing messages.
+
+Usage:
+    python backfill_embeddings.py                 # fill in missing/stale embeddings
+    python backfill_embeddings.py --user <uuid>   # only one user
+    python backfill_embeddings.py --force         # recompute everything
+    python backfill_embeddings.py --repack        # also convert stored embeddings to EMBEDDING_STORAGE
+"""
+import argparse
+from pymongo import UpdateOne
+from db import messages_collection, bump_messages_version
+from embeddings import attach_embeddings, embedding_update, is_embedding_stale, is_packed, pack_embedding, embedding_vector, EMBEDDING_STORAGE
+from embeddings import load_embedding_model
+from embedding_service import EmbeddingService
+
+# Not app's model: importing app would also start job workers and the index bootstrap
+model = EmbeddingService(load_embedding_model)
+
+
+def backfill(user_id=None, batch_size=256, force=False, repack=False):
+    if model.load() is None:
+        raise Exception("Semantic search model is not loaded")
+    query = {"userID": user_id} if user_id else {}
+    cursor = messages_collection.find(query, {"userID": 1, "text": 1, "insights": 1, "embedding": 1, "embeddingHash": 1})
+    batch, repack_batch = [], []
+    updated = 0
+    scanned = 0
+    for message in cursor:
+        scanned += 1
+        if force or is_embedding_stale(message):
+            batch.append(message)
+        elif repack and not is_packed(message["embedding"], EMBEDDING_STORAGE):
+            repack_batch.append(message)
+        if len(batch) >= batch_size:
+            updated += _write_batch(batch)
+            batch = []
+        if len(repack_batch) >= batch_size:
+            updated += _repack_batch(repack_batch)
+            repack_batch = []
+    if batch:
+        updated += _write_batch(batch)
+    if repack_batch:
+        updated += _repack_batch(repack_batch)
+    return scanned, updated
+
+
+def _write_batch(batch):
+    attach_embeddings(model, batch)
+    messages_collection.bulk_write(
+        [UpdateOne({"_id": m["_id"]}, {"$set": embedding_update(m)}) for m in batch],
+        ordered=False,
+    )
+    # Running servers rebuild these users' vector indexes with the new embeddings
+    for user_id in {m["userID"] for m in batch}:
+        bump_messages_version(user_id)
+    print(f"Embedded {len(batch)} messages")
+    return len(batch)
+
+
+def _repack_batch(batch):
+    """Rewrite up-to-date embeddings in the EMBEDDING_STORAGE format, without re-encoding"""
+    messages_collection.bulk_write(
+        [
+            UpdateOne({"_id": m["_id"]}, {"$set": {"embedding": pack_embedding(embedding_vector(m["embedding"]))}})
+            for m in batch
+        ],
+        ordered=False,
+    )
+    print(f"Repacked {len(batch)} embeddings")
+    return len(batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill message embeddings")
+    parser.add_argument("--user", help="Only backfill messages for this userUUID")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--force", action="store_true", help="Recompute even up-to-date embeddings")
+    parser.add_argument("--repack", action="store_true",
+                        help="Convert up-to-date embeddings stored in another format to EMBEDDING_STORAGE")
+    args = parser.parse_args()
+    scanned, updated = backfill(args.user, args.batch_size, args.force, args.repack)
+    print(f"Done: scanned {scanned} messages, updated {updated}")
@@ -0,0 +1,128 @@
+"""
+Accuracy and throughput of the embedding backends (embedding_backends.py)
+against the fp32 torch backend.
+
+Accuracy is measured on a fixed evaluation set of memories and search queries:
+the cosine similarity between each backend vector and the fp32 vector of the
+same sentence, and how many of each query's top-5 memories under fp32 the
+backend also ranks in its top 5. Throughput is sentences per second per core,
+with the process pinned to --cores CPUs.
+
+Usage:
+    python benchmark_embedding_backends.py
+    python benchmark_embedding_backends.py --backends torch torch-int8 onnx-int8 --cores 1 --sentences 2000
+"""
+import argparse
+import os
+import time
+import numpy as np
+from embeddings import load_embedding_model
+from vector_index import normalize_rows
+
+EVAL_MEMORIES = [
+    "I am allergic to peanuts and shellfish.",
+    "My sister Anna lives in Lisbon and works as an architect.",
+    "I'm training for a half marathon in October.",
+    "I prefer Python over JavaScript for backend work.",
+    "Our team deploys to production every Thursday afternoon.",
+    "I'm learning Japanese and practice kanji every morning.",
+    "My dog Biscuit is a three-year-old border collie.",
+    "I want to visit Patagonia next spring.",
+    "I switched to a standing desk because of back pain.",
+    "My favourite book is The Left Hand of Darkness.",
+    "I'm vegetarian but still eat eggs and dairy.",
+    "The quarterly report is due on the 15th of each month.",
+    "I use Neovim with a custom Lua configuration.",
+    "My landlord agreed to fix the heating by next week.",
+    "I'm saving for a down payment on an apartment.",
+    "I play bass guitar in a jazz trio on weekends.",
+    "My manager wants weekly written status updates.",
+    "I get migraines when I skip breakfast.",
+    "I'm planning a birthday dinner for my partner on June 3rd.",
+    "Our database is MongoDB and we index every user query.",
+    "I read about one science fiction novel a month.",
+    "I drink my coffee black, no sugar.",
+    "I'm preparing for the AWS solutions architect exam.",
+    "My grandmother's recipe for plum dumplings uses farmer's cheese.",
+    "I moved from Toronto to Berlin two years ago.",
+    "I'm trying to cut down screen time before bed.",
+    "The kids' school starts at 8:15 and ends at 3.",
+    "I like hiking trails with lakes and no crowds.",
+    "We use pull request reviews with at least two approvals.",
+    "I need to renew my passport before the trip in August.",
+    "I'm interested in woodworking and building a bookshelf.",
+    "My car is a 2016 Honda Civic that needs new brakes.",
+]
+EVAL_QUERIES = [
+    "food allergies",
+    "family members abroad",
+    "running and fitness goals",
+    "programming language preferences",
+    "travel plans",
+    "pets",
+    "health problems",
+    "work deadlines and meetings",
+    "hobbies and music",
+    "where do I live",
+]
+TOP_K = 5
+
+
+def pin_cores(cores):
+    """Restrict this process to `cores` CPUs (where supported); returns how many it may use"""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    if available is None:
+        return os.cpu_count() or 1
+    if cores:
+        os.sched_setaffinity(0, available[:cores])
+        return min(cores, len(available))
+    return len(available)
+
+
+def top_k(queries, memories):
+    return np.argsort(-(queries @ memories.T), axis=1)[:, :TOP_K]
+
+
+def accuracy(reference, candidate):
+    """(mean cosine to fp32, min cosine to fp32, top-k overlap with fp32) on the evaluation set"""
+    n = len(EVAL_MEMORIES)
+    cosines = np.sum(reference * candidate, axis=1)
+    expected, actual = top_k(reference[n:], reference[:n]), top_k(candidate[n:], candidate[:n])
+    overlap = np.mean([len(set(e) & set(a)) / TOP_K for e, a in zip(expected, actual)])
+    return float(cosines.mean()), float(cosines.min()), float(overlap)
+
+
+def throughput(model, n_sentences, batch_size):
+    texts = (EVAL_MEMORIES * (n_sentences // len(EVAL_MEMORIES) + 1))[:n_sentences]
+    model.encode(texts[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    return n_sentences / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends against fp32")
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8", "onnx", "onnx-int8"])
+    parser.add_argument("--cores", type=int, help="CPUs to pin the process to (default: all available)")
+    parser.add_argument("--sentences", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+    cores = pin_cores(args.cores)
+    eval_texts = EVAL_MEMORIES + EVAL_QUERIES
+    reference = normalize_rows(load_embedding_model("torch").encode(eval_texts))
+    print(f"{len(eval_texts)} evaluation sentences, {cores} core(s)")
+    print(f"{'backend':>10} | {'load':>6} | {'cos mean':>8} | {'cos min':>8} | {'top-5':>6} | {'sent/s/core':>11}")
+    for backend in args.backends:
+        start = time.perf_counter()
+        try:
+            model = load_embedding_model(backend)
+        except Exception as e:
+            print(f"{backend:>10} | unavailable: {e}")
+            continue
+        load_seconds = time.perf_counter() - start
+        mean_cos, min_cos, overlap = accuracy(reference, normalize_rows(model.encode(eval_texts)))
+        per_core = throughput(model, args.sentences, args.batch_size) / cores
+        print(
+            f"{backend:>10} | {load_seconds:5.1f}s | {mean_cos:8.4f} | {min_cos:8.4f}"
+            f" | {overlap:6.1%} | {per_core:11.1f}"
+        )
@@ -0,0 +1,84 @@
+"""
+Size, load time and accuracy of the embedding storage formats (EMBEDDING_STORAGE)
+compared with the original array-of-doubles format.
+
+For each format, N random unit vectors are encoded as BSON documents. The
+script reports:
+    - BSON bytes per embedding
+    - time to decode the documents and build the (n, dim) matrix (or, with
+      --mongo, to load them from a scratch collection in one query)
+    - Python memory allocated while decoding
+    - cosine similarity of the decoded vectors to the originals
+
+Usage:
+    python benchmark_embedding_storage.py
+    python benchmark_embedding_storage.py --vectors 50000 --mongo
+"""
+import argparse
+import time
+import tracemalloc
+import bson
+import numpy as np
+from embeddings import embedding_matrix, pack_embedding
+
+FORMATS = ["array", "float32", "float16", "int8"]
+SCRATCH_COLLECTION = "embedding_storage_benchmark"
+
+
+def stored_value(vector, storage):
+    return vector.tolist() if storage == "array" else pack_embedding(vector, storage)
+
+
+def load_from_bson(encoded):
+    docs = bson.decode_all(encoded)
+    return embedding_matrix([d["embedding"] for d in docs])
+
+
+def load_from_mongo(collection):
+    return embedding_matrix([d["embedding"] for d in collection.find({}, {"_id": 0, "embedding": 1})])
+
+
+def run(vectors, storage, collection=None):
+    docs = [{"embedding": stored_value(v, storage)} for v in vectors]
+    encoded = b"".join(bson.encode(d) for d in docs)
+    if collection is not None:
+        collection.delete_many({})
+        collection.insert_many(docs)
+        load = lambda: load_from_mongo(collection)
+    else:
+        load = lambda: load_from_bson(encoded)
+    start = time.perf_counter()
+    matrix = load()
+    elapsed = time.perf_counter() - start
+    # Measured on a second load, since tracing allocations slows decoding down
+    tracemalloc.start()
+    load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cosines = np.sum(matrix * vectors, axis=1) / np.linalg.norm(matrix, axis=1)
+    print(
+        f"{storage:>8} | {len(encoded) / len(vectors):7.0f} B | {elapsed * 1000:8.1f} ms"
+        f" | {peak / 2 ** 20:8.1f} MiB | {cosines.mean():.6f} | {cosines.min():.6f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark embedding storage formats")
+    parser.add_argument("--vectors", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--mongo", action="store_true", help="load from a scratch MongoDB collection")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    collection = None
+    if args.mongo:
+        from db import db
+        collection = db[SCRATCH_COLLECTION]
+    print(f"{'format':>8} | {'size':>9} | {'load':>11} | {'memory':>12} | cos mean | cos min")
+    try:
+        for storage in FORMATS:
+            run(vectors, storage, collection)
+    finally:
+        if collection is not None:
+            collection.drop()
@@ -0,0 +1,51 @@
+"""
+LLM call throughput at different concurrency levels, against the fake provider
+(simulated latency and transient errors), so it runs offline without API keys.
+
+Usage:
+    python benchmark_llm_throughput.py
+    python benchmark_llm_throughput.py --calls 500 --concurrency 1 16 64 --max-in-flight 64 --latency 0.3
+"""
+import argparse
+import time
+import numpy as np
+from llm_providers import FakeProvider
+from LLM import map_concurrently
+
+
+def run(provider, n_calls, concurrency):
+    latencies, failures = [], 0
+
+    async def call(i):
+        start = time.perf_counter()
+        try:
+            await provider.acomplete(f"Benchmark prompt\n{i}")
+            return time.perf_counter() - start, True
+        except Exception:
+            return time.perf_counter() - start, False
+
+    start = time.perf_counter()
+    for latency, ok in map_concurrently(call, range(n_calls), max_concurrency=concurrency):
+        latencies.append(latency)
+        failures += int(not ok)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{concurrency:>4} | {n_calls / elapsed:8.1f} calls/s"
+        f" | p50 {np.percentile(latencies, 50) * 1000:7.1f} ms"
+        f" | p95 {np.percentile(latencies, 95) * 1000:7.1f} ms"
+        f" | failed {failures}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark LLM call throughput with the fake provider")
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--latency", type=float, default=0.2, help="mean simulated seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of calls that fail transiently")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="provider concurrency limit")
+    args = parser.parse_args()
+    provider = FakeProvider(latency=args.latency, error_rate=args.error_rate,
+                            max_in_flight=args.max_in_flight, retry_base_delay=0.05)
+    for concurrency in args.concurrency:
+        run(provider, args.calls, concurrency)
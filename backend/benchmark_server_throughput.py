@@ -0,0 +1,114 @@
+"""
+Request throughput of the Flask dev server versus gunicorn (gunicorn.conf.py).
+
+Starts each server on its own port, waits for /health, then sends requests
+from a pool of client threads at each concurrency level. By default it hits
+/health (pure server overhead); with --user it runs semantic searches for
+that user, which also exercises the embedding model. Needs MongoDB running.
+
+Usage:
+    python benchmark_server_throughput.py
+    python benchmark_server_throughput.py --user <userUUID> --query "travel plans" --requests 500 --concurrency 1 8 32
+    python benchmark_server_throughput.py --url http://localhost:3000   # an already running server only
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+SERVERS = {
+    "dev": [sys.executable, "app.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+}
+STARTUP_TIMEOUT = 180
+
+
+def make_request(base_url, args):
+    if not args.user:
+        return urllib.request.Request(f"{base_url}/health")
+    body = json.dumps({"userUUID": args.user, "query": args.query, "top_k": 10, "compact": True})
+    return urllib.request.Request(
+        f"{base_url}/api/search", data=body.encode(), headers={"Content-Type": "application/json"}
+    )
+
+
+def send(base_url, args):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(make_request(base_url, args), timeout=60) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run(name, base_url, args):
+    for concurrency in args.concurrency:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(lambda _: send(base_url, args), range(args.requests)))
+            elapsed = time.perf_counter() - start
+        latencies = [latency for latency, _ in results]
+        failures = sum(not ok for _, ok in results)
+        print(
+            f"{name:>8} | {concurrency:>4} | {args.requests / elapsed:8.1f} req/s"
+            f" | p50 {np.percentile(latencies, 50) * 1000:7.1f} ms"
+            f" | p95 {np.percentile(latencies, 95) * 1000:7.1f} ms"
+            f" | failed {failures}"
+        )
+
+
+def wait_until_healthy(base_url, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2):
+                return
+        except Exception:
+            time.sleep(0.5)
+    raise RuntimeError("Server did not become healthy in time")
+
+
+def benchmark_server(name, port, args):
+    env = dict(os.environ, PORT=str(port), FLASK_DEBUG="false", JOB_WORKERS="0")
+    if args.workers:
+        env["WEB_CONCURRENCY"] = str(args.workers)
+    if args.threads:
+        env["GUNICORN_THREADS"] = str(args.threads)
+    process = subprocess.Popen(SERVERS[name], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_healthy(base_url, process)
+        # One untimed request, so the first measured ones don't pay for warm-up
+        send(base_url, args)
+        run(name, base_url, args)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark request throughput of the dev server vs. gunicorn")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--user", help="userUUID to search for (default: benchmark /health)")
+    parser.add_argument("--query", default="what did I plan", help="search query used with --user")
+    parser.add_argument("--servers", nargs="+", choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument("--workers", type=int, help="gunicorn worker processes (default: WEB_CONCURRENCY)")
+    parser.add_argument("--threads", type=int, help="gunicorn threads per worker (default: GUNICORN_THREADS)")
+    parser.add_argument("--port", type=int, default=3100, help="first port to start servers on")
+    parser.add_argument("--url", help="benchmark an already running server at this URL instead")
+    args = parser.parse_args()
+    if args.url:
+        run("server", args.url.rstrip("/"), args)
+    else:
+        for offset, name in enumerate(args.servers):
+            benchmark_server(name, args.port + offset, args)
@@ -0,0 +1,95 @@
+"""
+Backend startup time: how long `import app` takes, how long a freshly started
+server takes to answer /health/live and /health/ready, and the latency of the
+first semantic search, for each embedding model load mode
+(EMBEDDING_MODEL_LOAD). Needs MongoDB running.
+
+Usage:
+    python benchmark_startup.py
+    python benchmark_startup.py --runs 5 --modes background eager --server gunicorn
+    EMBEDDING_MODEL_PATH=models/all-MiniLM-L6-v2 python benchmark_startup.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import numpy as np
+from benchmark_server_throughput import SERVERS, STARTUP_TIMEOUT
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+
+
+def server_env(mode, port=None):
+    env = dict(os.environ, EMBEDDING_MODEL_LOAD=mode, FLASK_DEBUG="false", JOB_WORKERS="0")
+    if port:
+        env["PORT"] = str(port)
+    return env
+
+
+def time_import(mode):
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=server_env(mode), capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for(url, process, start):
+    """Seconds from `start` until `url` returns 200"""
+    while time.perf_counter() - start < STARTUP_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except Exception:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} did not return 200 in time")
+
+
+def first_search(base_url, user):
+    body = json.dumps({"userUUID": user, "query": "what did I plan", "top_k": 10, "compact": True})
+    request = urllib.request.Request(
+        f"{base_url}/api/search", data=body.encode(), headers={"Content-Type": "application/json"}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=STARTUP_TIMEOUT) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def time_server(server, mode, port, user):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        SERVERS[server], env=server_env(mode, port), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        live = wait_for(f"{base_url}/health/live", process, start)
+        ready = wait_for(f"{base_url}/health/ready", process, start)
+        return live, ready, first_search(base_url, user)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark backend startup and first-request latency")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=["background", "eager", "lazy"], default=["background", "eager"])
+    parser.add_argument("--server", choices=list(SERVERS), default="dev")
+    parser.add_argument("--user", default="benchmark-startup", help="userUUID for the first search")
+    parser.add_argument("--port", type=int, default=3200)
+    args = parser.parse_args()
+    print(f"{'mode':>10} | {'import':>9} | {'live':>9} | {'ready':>9} | {'1st search':>10}")
+    for mode in args.modes:
+        results = [
+            (time_import(mode), *time_server(args.server, mode, args.port, args.user))
+            for _ in range(args.runs)
+        ]
+        imported, live, ready, search = np.median(results, axis=0)
+        print(f"{mode:>10} | {imported:8.2f}s | {live:8.2f}s | {ready:8.2f}s | {search * 1000:8.1f}ms")
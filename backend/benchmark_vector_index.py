@@ -0,0 +1,71 @@
+"""
+Recall vs latency of the per-user VectorIndex against the exact search path
+(sklearn cosine_similarity over every message plus a full sort).
+
+Uses synthetic clustered 384-dim vectors so it runs without MongoDB or the model.
+
+Usage:
+    python benchmark_vector_index.py
+    python benchmark_vector_index.py --sizes 1000 10000 --queries 50 --top-k 10
+"""
+import argparse
+import time
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from vector_index import VectorIndex
+
+DIM = 384
+
+
+def make_vectors(n, rng, n_topics=200):
+    topics = rng.normal(size=(n_topics, DIM)).astype(np.float32)
+    labels = rng.integers(0, n_topics, size=n)
+    return topics[labels] + 0.6 * rng.normal(size=(n, DIM)).astype(np.float32)
+
+
+def exact_search(query, vectors, top_k):
+    similarities = cosine_similarity(query.reshape(1, -1), vectors)[0]
+    order = sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)
+    return order[:top_k]
+
+
+def run(size, n_queries, top_k, rng):
+    vectors = make_vectors(size, rng)
+    queries = make_vectors(n_queries, rng)
+    ids = list(range(size))
+
+    start = time.perf_counter()
+    index = VectorIndex()
+    index.add(ids, vectors)
+    build_s = time.perf_counter() - start
+
+    exact_times, index_times, recalls = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        truth = exact_search(query, vectors, top_k)
+        exact_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        hits = index.search(query, top_k)
+        index_times.append(time.perf_counter() - start)
+
+        found = {item_id for item_id, _ in hits}
+        recalls.append(len(found.intersection(truth)) / top_k)
+
+    print(
+        f"{size:>7} | {'ivf' if index.is_trained else 'exact':>5} | build {build_s * 1000:8.1f} ms"
+        f" | exact p50 {np.median(exact_times) * 1000:8.2f} ms"
+        f" | index p50 {np.median(index_times) * 1000:7.3f} ms"
+        f" | recall@{top_k} {np.mean(recalls):.3f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the in-memory vector index")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+    for size in args.sizes:
+        run(size, args.queries, args.top_k, rng)
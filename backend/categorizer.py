@@ -0,0 +1,187 @@
+"""
+Embedding pre-filter for auto-categorization.
+
+Each folder gets a centroid embedding built from its name/description and the
+embeddings of memories already in it. A new memory that is clearly closest to
+one folder (score above CATEGORIZE_LOCAL_THRESHOLD and ahead of the runner-up by
+CATEGORIZE_LOCAL_MARGIN) is assigned locally; anything ambiguous still goes to
+the LLM. A sample of local decisions (CATEGORIZE_SHADOW_RATE) is also sent to
+the LLM to measure how often the two agree.
+"""
+import os
+import random
+import threading
+import time
+import numpy as np
+from bson import ObjectId
+from db import messages_collection
+from embeddings import embedding_matrix, embedding_vector
+from folders import folder_message_map
+from vector_index import normalize_rows
+
+CATEGORIZE_PREFILTER = os.getenv("CATEGORIZE_PREFILTER", "true").lower() == "true"
+CATEGORIZE_LOCAL_THRESHOLD = float(os.getenv("CATEGORIZE_LOCAL_THRESHOLD", 0.55))
+CATEGORIZE_LOCAL_MARGIN = float(os.getenv("CATEGORIZE_LOCAL_MARGIN", 0.08))
+CATEGORIZE_SHADOW_RATE = float(os.getenv("CATEGORIZE_SHADOW_RATE", 0.05))
+CENTROID_CACHE_SECONDS = int(os.getenv("CENTROID_CACHE_SECONDS", 300))
+# Most recent members per folder that contribute to its centroid
+CENTROID_MAX_MEMBERS = 200
+# Weight of the name/description embedding vs. the mean of member embeddings
+DESCRIPTION_WEIGHT = 0.5
+
+
+class CategorizationMetrics:
+    """Counters for how many memories were categorized locally vs. by the LLM"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.memories = 0
+            self.local = 0
+            self.llm_calls = 0
+            self.shadow_checks = 0
+            self.shadow_agreements = 0
+
+    def record(self, local=False, llm_call=False):
+        with self._lock:
+            self.memories += 1
+            self.local += int(local)
+            self.llm_calls += int(llm_call)
+
+    def record_shadow(self, agreed):
+        with self._lock:
+            self.shadow_checks += 1
+            self.shadow_agreements += int(agreed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "memories": self.memories,
+                "localAssignments": self.local,
+                "llmCalls": self.llm_calls,
+                "llmCallReduction": self.local / self.memories if self.memories else 0.0,
+                "shadowChecks": self.shadow_checks,
+                "shadowAgreement": (
+                    self.shadow_agreements / self.shadow_checks if self.shadow_checks else None
+                ),
+            }
+
+
+metrics = CategorizationMetrics()
+_centroid_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _build_centroids(model, userID, folders):
+    """(folder names, normalized centroid matrix) for every folder except Misc"""
+    folders = [f for f in folders if f["name"].lower() != "misc"]
+    if not folders:
+        return [], None
+    descriptions = normalize_rows(model.encode(
+        [f"{f['name']}: {f.get('description', '')}" for f in folders]
+    ))
+    members = folder_message_map(userID)
+    centroids = []
+    for folder, description_vector in zip(folders, descriptions):
+        member_ids = members.get(folder["folderID"], [])[-CENTROID_MAX_MEMBERS:]
+        object_ids = [ObjectId(mid) for mid in member_ids if ObjectId.is_valid(mid)]
+        vectors = embedding_matrix([
+            m["embedding"]
+            for m in messages_collection.find(
+                {"_id": {"$in": object_ids}, "userID": userID}, {"embedding": 1}
+            )
+            if m.get("embedding")
+        ] if object_ids else [])
+        if len(vectors):
+            member_mean = normalize_rows(np.mean(normalize_rows(vectors), axis=0))[0]
+            centroids.append(DESCRIPTION_WEIGHT * description_vector + (1 - DESCRIPTION_WEIGHT) * member_mean)
+        else:
+            centroids.append(description_vector)
+    return [f["name"] for f in folders], normalize_rows(centroids)
+
+
+def get_folder_centroids(model, userID, folders):
+    """Cached folder centroids; rebuilt when folders change or the cache entry expires"""
+    key = tuple((f["folderID"], f["name"], f.get("description", "")) for f in folders)
+    now = time.monotonic()
+    cached = _centroid_cache.get(userID)
+    if cached and cached[0] > now and cached[1] == key:
+        return cached[2], cached[3]
+    names, centroids = _build_centroids(model, userID, folders)
+    with _cache_lock:
+        _centroid_cache[userID] = (now + CENTROID_CACHE_SECONDS, key, names, centroids)
+    return names, centroids
+
+
+def invalidate_centroids(userID):
+    with _cache_lock:
+        _centroid_cache.pop(userID, None)
+
+
+def local_folder_match(model, userID, folders, embedding):
+    """The folder name this embedding clearly belongs to, or None if it's ambiguous"""
+    names, centroids = get_folder_centroids(model, userID, folders)
+    if centroids is None:
+        return None
+    scores = centroids @ normalize_rows(embedding)[0]
+    order = np.argsort(-scores)
+    best = scores[order[0]]
+    runner_up = scores[order[1]] if len(order) > 1 else -1.0
+    if best >= CATEGORIZE_LOCAL_THRESHOLD and best - runner_up >= CATEGORIZE_LOCAL_MARGIN:
+        return names[order[0]]
+    return None
+
+
+def categorize_memory(model, userID, message, folders, llm_categorize):
+    """
+    Folder names for a memory: a confident local match when there is one,
+    otherwise `llm_categorize(text, folders)`.
+    """
+    local = None
+    if CATEGORIZE_PREFILTER and model and message.get("embedding"):
+        local = local_folder_match(model, userID, folders, embedding_vector(message["embedding"]))
+    if local is None:
+        metrics.record(llm_call=True)
+        return llm_categorize(message.get("text", ""), folders)
+    metrics.record(local=True)
+    if CATEGORIZE_SHADOW_RATE and random.random() < CATEGORIZE_SHADOW_RATE:
+        llm_folders = llm_categorize(message.get("text", ""), folders)
+        metrics.record_shadow(local in llm_folders)
+    return [local]
+
+
+def categorize_memories(model, userID, messages, folders, llm_batch_categorize):
+    """
+    Batched version of categorize_memory: {message id: [folder names]}.
+    Confident local matches are assigned directly and everything else (plus
+    the shadow-checked sample) goes through one `llm_batch_categorize(memories,
+    folders)` call, which takes and returns memories keyed by 'id'.
+    """
+    results = {}
+    to_llm = []
+    shadow = {}
+    for message in messages:
+        mid = str(message["_id"])
+        local = None
+        if CATEGORIZE_PREFILTER and model and message.get("embedding"):
+            local = local_folder_match(model, userID, folders, embedding_vector(message["embedding"]))
+        if local is None:
+            metrics.record(llm_call=True)
+            to_llm.append({"id": mid, "text": message.get("text", "")})
+            continue
+        metrics.record(local=True)
+        results[mid] = [local]
+        if CATEGORIZE_SHADOW_RATE and random.random() < CATEGORIZE_SHADOW_RATE:
+            shadow[mid] = local
+            to_llm.append({"id": mid, "text": message.get("text", "")})
+    if to_llm:
+        llm_results = llm_batch_categorize(to_llm, folders)
+        for mid, names in llm_results.items():
+            if mid in shadow:
+                metrics.record_shadow(shadow[mid] in names)
+            else:
+                results[mid] = names
+    return results
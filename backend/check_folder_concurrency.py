@@ -0,0 +1,65 @@
+"""
+Lost-update check for folder membership under concurrency. Many threads add
+and remove messages in the same folders at once; afterwards every add that
+wasn't removed must still be there. With the old read-modify-write of the
+whole users.folders array, concurrent writers overwrote each other.
+
+Runs against the configured MongoDB and cleans up after itself:
+
+    python check_folder_concurrency.py --threads 16 --ops 200
+"""
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from db import ensure_indexes
+from folders import add_to_folder, remove_from_folder, folder_message_ids, clear_memberships
+
+FOLDERS = ["folder-a", "folder-b", "folder-c"]
+
+
+def worker(userID, worker_no, ops):
+    """Add `ops` messages round-robin across FOLDERS, removing every third one in each folder again"""
+    kept = {folder: set() for folder in FOLDERS}
+    for i in range(ops):
+        folder = FOLDERS[i % len(FOLDERS)]
+        message_id = f"{worker_no}-{i}"
+        add_to_folder(userID, folder, [message_id])
+        if (i // len(FOLDERS)) % 3 == 2:
+            remove_from_folder(userID, folder, [message_id])
+        else:
+            kept[folder].add(message_id)
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check folder membership for lost updates")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200)
+    args = parser.parse_args()
+    ensure_indexes()
+    userID = f"concurrency-check-{uuid4()}"
+    try:
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(lambda n: worker(userID, n, args.ops), range(args.threads)))
+        lost = 0
+        for folder in FOLDERS:
+            expected = set().union(*(r[folder] for r in results))
+            stored = folder_message_ids(userID, folder)
+            missing = expected - set(stored)
+            extra = set(stored) - expected
+            duplicates = len(stored) - len(set(stored))
+            print(f"{folder}: expected {len(expected)}, stored {len(stored)}, "
+                  f"missing {len(missing)}, unexpected {len(extra)}, duplicates {duplicates}")
+            lost += len(missing) + len(extra) + duplicates
+        if lost:
+            print("FAILED: folder membership lost or duplicated updates")
+            return 1
+        print("OK: no lost updates")
+        return 0
+    finally:
+        clear_memberships(userID)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
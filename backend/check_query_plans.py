@@ -0,0 +1,75 @@
+"""
+Explain the queries behind the hot API routes and fail if any of them falls
+back to a collection scan (COLLSCAN). The backend has no test suite, so this
+is a standalone check: it needs a running MongoDB (it creates the indexes from
+db.INDEXES itself) and exits non-zero on any COLLSCAN, e.g. as a CI step after
+starting MongoDB:
+
+    python check_query_plans.py
+"""
+import sys
+from datetime import datetime
+from bson import ObjectId
+from db import messages_collection, users_collection, memberships_collection, jobs_collection, ensure_indexes
+from db import message_versions_collection
+
+SAMPLE_USER = "query-plan-check"
+
+
+def hot_queries():
+    message_id = ObjectId()
+    now = datetime.now()
+    return [
+        ("get_or_create_user", users_collection.find({"userID": SAMPLE_USER}).limit(1)),
+        ("get_messages", messages_collection.find({"userID": SAMPLE_USER}).sort("_id", 1)),
+        ("get_messages cursor", messages_collection.find(
+            {"userID": SAMPLE_USER, "_id": {"$gt": message_id}}).sort("_id", 1).limit(100)),
+        ("get_messages since", messages_collection.find(
+            {"userID": SAMPLE_USER, "timestamp": {"$gt": "2024-01-01T00:00:00"}}).sort("_id", 1)),
+        ("message by id", messages_collection.find({"_id": message_id, "userID": SAMPLE_USER}).limit(1)),
+        ("messages by ids", messages_collection.find(
+            {"_id": {"$in": [message_id]}, "userID": SAMPLE_USER})),
+        ("search time filter", messages_collection.find(
+            {"userID": SAMPLE_USER, "timestamp": {"$gt": "2024-01-01T00:00:00", "$lt": "2024-02-01T00:00:00"}},
+            {"_id": 1})),
+        ("search folder filter", memberships_collection.find(
+            {"userID": SAMPLE_USER, "folderID": "folder"}, {"messageID": 1, "_id": 0}).sort("_id", 1)),
+        ("dedupe content hash", messages_collection.find(
+            {"userID": SAMPLE_USER, "contentHash": {"$in": ["hash"]}}, {"contentHash": 1})),
+        ("messages version", message_versions_collection.find({"_id": SAMPLE_USER}, {"version": 1}).limit(1)),
+        ("claim job", jobs_collection.find({
+            "type": {"$in": ["process_message"]},
+            "$or": [{"status": "pending", "runAt": {"$lte": now}}, {"status": "running", "leaseUntil": {"$lte": now}}],
+        }).sort("runAt", 1).limit(1)),
+    ]
+
+
+def plan_stages(plan):
+    """All stage names in an explain() plan tree"""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+
+def main():
+    ensure_indexes()
+    failures = []
+    for name, cursor in hot_queries():
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = plan_stages(plan)
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        print(f"{name:<22} {status:<9} {' <- '.join(s for s in stages if s)}")
+        if status != "ok":
+            failures.append(name)
+    if failures:
+        print(f"Collection scans in: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
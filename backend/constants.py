@@ -58,6 +58,19 @@ Please suggest one or more folders from the list above that best fit this memory
 Return only a JSON array of strings, with no code block, no markdown, and no explanation. Just the plain JSON array, like: ["Technology", "Misc"]
 """
 
+BATCH_CATEGORIZE_PROMPT = """You are an assistant that helps categorize several user memories into folders at once.
+
+Here are the available folders and their descriptions:
+{folder_list_str}
+
+Here are the memories (each with an ID):
+{memories_list_str}
+
+For every memory, suggest one or more folders from the list above that best fit it. If none fit, assign it to the \"Misc\" folder.
+Return only a JSON object mapping each memory ID to an array of folder names, with no code block, no markdown, and no explanation.
+Example: {{"id1": ["Technology"], "id2": ["Food", "Travel"]}}
+"""
+
 BATCH_AUTOPOPULATE_PROMPT = """You are an assistant that helps organize user memories into a specific folder.
 
 Folder name: {folder_name}
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from pymongo.errors import ConnectionFailure
+from gridfs import GridFSBucket
+
+load_dotenv()
+
+# MongoDB connection
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+client = MongoClient(MONGO_URI)
+db = client["memory_chat"]
+messages_collection = db["messages"]
+folders_collection = db["folders"]
+users_collection = db["users"]
+memberships_collection = db["folder_memberships"]
+jobs_collection = db["jobs"]
+llm_cache_collection = db["llm_cache"]
+# Per-user counter bumped on every message write, so each process can tell
+# whether its in-memory search indexes are current ({_id: userID, version})
+message_versions_collection = db["message_versions"]
+# Uploaded conversations.json exports, read back incrementally by import jobs
+imports_bucket = GridFSBucket(db, bucket_name="imports")
+
+# How long cached LLM results are kept in MongoDB
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+# How long finished (done or failed) jobs are kept
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+
+# Index creation at startup waits this long for MongoDB before retrying, every
+# INDEX_BOOTSTRAP_RETRY_SECONDS, until it succeeds
+INDEX_BOOTSTRAP_TIMEOUT_MS = int(os.getenv("INDEX_BOOTSTRAP_TIMEOUT_MS", 2000))
+INDEX_BOOTSTRAP_RETRY_SECONDS = float(os.getenv("INDEX_BOOTSTRAP_RETRY_SECONDS", 10))
+
+# (collection, keys, options) for every index the hot routes rely on
+INDEXES = [
+    (users_collection, [("userID", ASCENDING)], {"unique": True, "name": "userID_unique"}),
+    (messages_collection, [("userID", ASCENDING), ("_id", ASCENDING)], {"name": "userID_id"}),
+    (messages_collection, [("userID", ASCENDING), ("timestamp", ASCENDING)], {"name": "userID_timestamp"}),
+    (messages_collection, [("userID", ASCENDING), ("contentHash", ASCENDING)], {"name": "userID_contentHash"}),
+    (messages_collection, [("importJobId", ASCENDING), ("importIndex", ASCENDING)],
+     {"sparse": True, "name": "importJobId_importIndex"}),
+    (memberships_collection, [("userID", ASCENDING), ("folderID", ASCENDING), ("messageID", ASCENDING)],
+     {"unique": True, "name": "userID_folderID_messageID_unique"}),
+    (memberships_collection, [("userID", ASCENDING), ("folderID", ASCENDING), ("_id", ASCENDING)],
+     {"name": "userID_folderID_id"}),
+    (memberships_collection, [("userID", ASCENDING), ("messageID", ASCENDING)], {"name": "userID_messageID"}),
+    (jobs_collection, [("status", ASCENDING), ("runAt", ASCENDING)], {"name": "status_runAt"}),
+    (jobs_collection, [("finishedAt", ASCENDING)],
+     {"expireAfterSeconds": JOB_RETENTION_SECONDS, "name": "finishedAt_ttl"}),
+    (llm_cache_collection, [("createdAt", ASCENDING)],
+     {"expireAfterSeconds": LLM_CACHE_TTL_SECONDS, "name": "createdAt_ttl"}),
+]
+
+
+def ensure_indexes(database=db):
+    """
+    Create the indexes the API depends on (no-op for indexes that already
+    exist). Returns {index name: error} for the ones that couldn't be created.
+    """
+    errors = {}
+    for collection, keys, options in INDEXES:
+        try:
+            database[collection.name].create_index(keys, **options)
+        except Exception as e:
+            print(f"Error creating index {options['name']} on {collection.name}: {e}")
+            errors[options["name"]] = e
+    return errors
+
+
+def messages_version(userID):
+    doc = message_versions_collection.find_one({"_id": userID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+def bump_messages_version(userID):
+    """Record a write to the user's messages (after it's done) and return the new version"""
+    doc = message_versions_collection.find_one_and_update(
+        {"_id": userID}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+
+class IndexBootstrap:
+    """
+    Runs ensure_indexes() in a background thread so an unreachable MongoDB
+    doesn't block startup. It uses its own client with a short server
+    selection timeout and retries until MongoDB is reachable.
+    """
+
+    def __init__(self):
+        self.state = "not started"  # then "building", "ok" or "failed"
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.state = "building"
+                self._thread = threading.Thread(target=self._run, name="index-bootstrap", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        bootstrap_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=INDEX_BOOTSTRAP_TIMEOUT_MS)
+        try:
+            while True:
+                try:
+                    bootstrap_client.admin.command("ping")
+                    errors = ensure_indexes(bootstrap_client[db.name])
+                except ConnectionFailure as e:
+                    errors = {"ping": e}
+                if not errors:
+                    self.state, self.error = "ok", None
+                    return
+                self.error = "; ".join(f"{name}: {e}" for name, e in errors.items())
+                # Anything but a connection problem (e.g. a conflicting index) won't fix itself
+                if not any(isinstance(e, ConnectionFailure) for e in errors.values()):
+                    self.state = "failed"
+                    return
+                time.sleep(INDEX_BOOTSTRAP_RETRY_SECONDS)
+        finally:
+            bootstrap_client.close()
+
+
+index_bootstrap = IndexBootstrap()
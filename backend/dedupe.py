@@ -0,0 +1,155 @@
+"""
+Duplicate detection for memories.
+
+On ingest, every incoming memory is compared against the user's existing
+memories before it is stored (and before any LLM call): first by a hash of its
+normalized text, then by cosine similarity of its embedding against the user's
+vector index. A memory scoring at least DEDUPE_SIMILARITY against an existing
+one is treated as a copy of it.
+
+The compaction job applies the same rules to memories that are already stored:
+the oldest memory of each duplicate group is kept, folder memberships of the
+others are moved onto it, and the others are deleted.
+"""
+import hashlib
+import os
+from datetime import datetime
+import numpy as np
+from bson import ObjectId
+from db import messages_collection
+from embeddings import embedding_matrix, embedding_vector
+from folders import move_memberships
+from vector_index import normalize_rows
+
+DEDUPE_ON_INGEST = os.getenv("DEDUPE_ON_INGEST", "true").lower() == "true"
+DEDUPE_SIMILARITY = float(os.getenv("DEDUPE_SIMILARITY", 0.95))
+# Nearest neighbours checked per memory during compaction
+COMPACT_NEIGHBORS = 10
+COMPACT_CHUNK_SIZE = 500
+
+
+def content_hash(text):
+    """Hash of the text with case and whitespace normalized"""
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def find_duplicates(userID, messages, index=None):
+    """
+    Check messages that are about to be inserted (dicts with 'text' and, when
+    the model is loaded, 'embedding'); sets 'contentHash' on each. Returns a
+    list aligned with `messages`: None for a new memory, the id of the existing
+    memory it duplicates, or the position of an earlier message in the same
+    list that it duplicates.
+    """
+    hashes = [content_hash(m["text"]) for m in messages]
+    for message, h in zip(messages, hashes):
+        message["contentHash"] = h
+    if not DEDUPE_ON_INGEST:
+        return [None] * len(messages)
+    existing = {
+        m["contentHash"]: str(m["_id"])
+        for m in messages_collection.find(
+            {"userID": userID, "contentHash": {"$in": list(set(hashes))}}, {"contentHash": 1}
+        )
+    }
+    vectors = None
+    if messages and all(m.get("embedding") for m in messages):
+        vectors = normalize_rows(embedding_matrix([m["embedding"] for m in messages]))
+    matches, kept = [], []
+    for i, h in enumerate(hashes):
+        match = existing.get(h)
+        if match is None:
+            match = next((j for j in kept if hashes[j] == h), None)
+        if match is None and vectors is not None:
+            if index is not None and len(index):
+                hits = index.search(vectors[i], top_k=1, min_score=DEDUPE_SIMILARITY)
+                match = hits[0][0] if hits else None
+            if match is None and kept:
+                scores = vectors[kept] @ vectors[i]
+                best = int(np.argmax(scores))
+                if scores[best] >= DEDUPE_SIMILARITY:
+                    match = kept[best]
+        if match is None:
+            kept.append(i)
+        matches.append(match)
+    return matches
+
+
+def find_stored_near_duplicate(message, index):
+    """
+    Id of another memory whose embedding scores at least DEDUPE_SIMILARITY
+    against this stored message's, or None. For memories whose insights are
+    extracted after they are stored: only then is their embedding built from
+    the same text + insights as the ones it is compared with.
+    """
+    if not DEDUPE_ON_INGEST or index is None or not message.get("embedding"):
+        return None
+    vector = normalize_rows(embedding_vector(message["embedding"]))[0]
+    hits = index.search(vector, top_k=2, min_score=DEDUPE_SIMILARITY)
+    return next((mid for mid, _ in hits if mid != str(message["_id"])), None)
+
+
+def mark_seen(message_ids):
+    """Record that copies of these stored memories were just ingested again (instead of storing the copies)"""
+    if message_ids:
+        messages_collection.update_many(
+            {"_id": {"$in": [ObjectId(mid) for mid in set(message_ids)]}},
+            {"$set": {"lastSeenAt": datetime.now().isoformat()}},
+        )
+
+
+def backfill_content_hashes(userID):
+    """Set contentHash on the user's memories stored before it existed. Returns how many were updated."""
+    updated = 0
+    cursor = messages_collection.find({"userID": userID, "contentHash": {"$exists": False}}, {"text": 1})
+    for m in cursor:
+        messages_collection.update_one({"_id": m["_id"]}, {"$set": {"contentHash": content_hash(m.get("text", ""))}})
+        updated += 1
+    return updated
+
+
+def find_stored_duplicates(userID, index=None):
+    """
+    {duplicate id: id of the memory to keep} for the user's stored memories.
+    Exact copies (same contentHash) collapse onto the oldest; then each
+    remaining memory, oldest first, claims newer memories within
+    DEDUPE_SIMILARITY among its nearest neighbours.
+    """
+    backfill_content_hashes(userID)
+    keep_for = {}
+    groups = messages_collection.aggregate([
+        {"$match": {"userID": userID}},
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": "$contentHash", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for group in groups:
+        keep, *duplicates = [str(mid) for mid in group["ids"]]
+        keep_for.update({mid: keep for mid in duplicates})
+    if index is None or not len(index):
+        return keep_for
+    cursor = messages_collection.find({"userID": userID}, {"embedding": 1}).sort("_id", 1)
+    for m in cursor:
+        mid = str(m["_id"])
+        if mid in keep_for or not m.get("embedding"):
+            continue
+        for other, _ in index.search(embedding_vector(m["embedding"]), top_k=COMPACT_NEIGHBORS, min_score=DEDUPE_SIMILARITY):
+            if other != mid and other not in keep_for and ObjectId(other) > m["_id"]:
+                keep_for[other] = mid
+    # The kept memory of an exact-copy group may itself have been claimed above
+    for mid, keep in keep_for.items():
+        while keep in keep_for:
+            keep = keep_for[keep]
+        keep_for[mid] = keep
+    return keep_for
+
+
+def merge_duplicates(userID, keep_for):
+    """Move folder memberships of each duplicate onto the memory kept in its place, then delete the duplicates"""
+    duplicate_ids = list(keep_for)
+    for start in range(0, len(duplicate_ids), COMPACT_CHUNK_SIZE):
+        chunk = duplicate_ids[start:start + COMPACT_CHUNK_SIZE]
+        move_memberships(userID, {mid: keep_for[mid] for mid in chunk})
+        messages_collection.delete_many({"userID": userID, "_id": {"$in": [ObjectId(mid) for mid in chunk]}})
+    return len(duplicate_ids)
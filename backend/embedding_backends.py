@@ -0,0 +1,83 @@
+"""
+Embedding backends: different runtimes for the same sentence transformer.
+
+Every backend exposes `encode(texts, batch_size)` returning an (n, dim)
+float32 matrix, so EmbeddingService can run any of them. They produce vectors
+for the same model, close enough to the fp32 ones (see
+benchmark_embedding_backends.py) that stored embeddings stay comparable when
+switching backends.
+
+Backends (EMBEDDING_BACKEND):
+
+    torch      - SentenceTransformer in fp32 (default)
+    torch-int8 - the same model with its Linear layers dynamically quantized to int8
+    onnx       - ONNX Runtime (needs `pip install sentence-transformers[onnx]`)
+    onnx-int8  - ONNX Runtime with an int8-quantized export (EMBEDDING_ONNX_INT8_FILE)
+"""
+import os
+import numpy as np
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# Quantized ONNX file inside the model repo; all-MiniLM-L6-v2 also publishes
+# onnx/model_qint8_avx512_vnni.onnx and onnx/model_qint8_arm64.onnx
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+
+class EmbeddingBackend:
+    name = None
+
+    def __init__(self, source):
+        """`source` is a model name on the Hugging Face hub or a local model directory"""
+        from sentence_transformers import SentenceTransformer
+        self.source = source
+        self.model = SentenceTransformer(source, **self._model_kwargs())
+
+    def _model_kwargs(self):
+        return {}
+
+    def encode(self, texts, batch_size=32):
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+
+class TorchBackend(EmbeddingBackend):
+    name = "torch"
+
+
+class TorchInt8Backend(TorchBackend):
+    """fp32 weights converted to int8 at load time; activations are quantized on the fly"""
+
+    name = "torch-int8"
+
+    def __init__(self, source):
+        import torch
+        super().__init__(source)
+        self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class OnnxBackend(EmbeddingBackend):
+    name = "onnx"
+
+    def _model_kwargs(self):
+        return {"backend": "onnx"}
+
+
+class OnnxInt8Backend(OnnxBackend):
+    name = "onnx-int8"
+
+    def _model_kwargs(self):
+        return {"backend": "onnx", "model_kwargs": {"file_name": EMBEDDING_ONNX_INT8_FILE}}
+
+
+EMBEDDING_BACKENDS = {
+    "torch": TorchBackend,
+    "torch-int8": TorchInt8Backend,
+    "onnx": OnnxBackend,
+    "onnx-int8": OnnxInt8Backend,
+}
+
+
+def load_embedding_backend(source, name=None):
+    name = (name or EMBEDDING_BACKEND).lower()
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name}")
+    return EMBEDDING_BACKENDS[name](source)
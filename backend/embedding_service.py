@@ -0,0 +1,221 @@
+"""
+In-process embedding worker that micro-batches encode requests.
+
+Request handlers run in many threads, and encoding each request's few texts
+on its own runs lots of tiny forward passes. Instead, `submit(texts)` queues
+the texts and returns a Future; a single worker thread takes the first
+waiting request, keeps collecting requests until EMBED_MAX_BATCH texts are
+queued or EMBED_MAX_WAIT_MS has passed, encodes them in one forward pass and
+resolves every caller's future with its own rows. `encode(texts)` blocks on
+the future, so the service can be passed anywhere a SentenceTransformer is.
+
+The model itself is loaded by the service (EMBEDDING_MODEL_LOAD):
+
+    background - in a background thread started at app import, followed by one
+                 warm-up encode, so the server answers /health/live right away
+                 and /health/ready once the model is loaded (default)
+    eager      - before import finishes; gunicorn.conf.py uses this so the
+                 model is loaded before workers are forked
+    lazy       - on the first encode (for scripts)
+
+Encodes submitted before the model is loaded wait for it. The worker thread
+is started on first use, so the service can be created before gunicorn forks
+its workers.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", 64))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", 5))
+EMBEDDING_MODEL_LOAD = os.getenv("EMBEDDING_MODEL_LOAD", "background").lower()
+
+
+class Histogram:
+    """Counts of observed values in power-of-two buckets (0, 1, 2, 3-4, 5-8, ...), keyed by upper bound"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        bound = 0 if value <= 0 else 1 << (int(value) - 1).bit_length()
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "buckets": {str(bound): n for bound, n in sorted(self.buckets.items())},
+        }
+
+
+class EmbeddingRequest:
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+
+
+class EmbeddingService:
+    def __init__(self, load_model, max_batch=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS):
+        self._load_model = load_model
+        self.model = None
+        self.load_error = None
+        self.load_seconds = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._loader = None
+        self._loading = False
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.queue_depth = Histogram()
+        self.batch_texts = Histogram()
+        self.batch_requests = Histogram()
+        self.failed_batches = 0
+        self.encode_seconds = 0.0
+
+    def __bool__(self):
+        """False once loading the model has failed; callers fall back to non-semantic paths"""
+        return self.load_error is None
+
+    @property
+    def ready(self):
+        """Not in the middle of loading the model (lazy mode loads on the first encode instead)"""
+        return self.state != "loading"
+
+    @property
+    def state(self):
+        if self.model is not None:
+            return "loaded"
+        if self.load_error is not None:
+            return "failed"
+        return "loading" if self._loading else "not loaded"
+
+    def load(self):
+        """Load the model unless already loaded; returns it, or None if loading failed"""
+        with self._load_lock:
+            if not self._loaded:
+                self._loading = True
+                start = time.perf_counter()
+                try:
+                    self.model = self._load_model()
+                    print("Semantic search model loaded successfully")
+                except Exception as e:
+                    print(f"Error loading semantic search model: {e}")
+                    self.load_error = str(e)
+                self.load_seconds = time.perf_counter() - start
+                self._loaded = True
+                self._loading = False
+        return self.model
+
+    def load_in_background(self):
+        """Load the model (if needed) and run one warm-up encode in a background thread"""
+        with self._lock:
+            if self._loader is None:
+                self._loading = not self._loaded
+                self._loader = threading.Thread(target=self._warm_up, name="embedding-loader", daemon=True)
+                self._loader.start()
+
+    def _warm_up(self):
+        if self.load() is not None:
+            try:
+                self.encode(["warm up"])
+            except Exception as e:
+                print(f"Error warming up semantic search model: {e}")
+
+    def submit(self, texts):
+        """Future resolving to an (len(texts), dim) float32 matrix"""
+        request = EmbeddingRequest(list(texts))
+        if not request.texts:
+            request.future.set_result(np.zeros((0, 0), dtype=np.float32))
+            return request.future
+        self._ensure_started()
+        with self._metrics_lock:
+            self.queue_depth.record(self._queue.qsize())
+        self._queue.put(request)
+        return request.future
+
+    def encode(self, texts):
+        """Blocking submit(), with the same result as SentenceTransformer.encode(texts)"""
+        return self.submit(texts).result()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-worker", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Callers that gave up (cancelled) don't need encoding
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if batch:
+                self._encode(batch)
+
+    def _collect_batch(self):
+        """The first waiting request plus whatever else arrives before the batch is full or the deadline passes"""
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _encode(self, batch):
+        texts = [text for request in batch for text in request.texts]
+        start = time.perf_counter()
+        try:
+            model = self.load()
+            if model is None:
+                raise Exception(f"Semantic search model not loaded: {self.load_error}")
+            vectors = np.asarray(model.encode(texts, batch_size=self.max_batch), dtype=np.float32)
+        except Exception as e:
+            with self._metrics_lock:
+                self.failed_batches += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        with self._metrics_lock:
+            self.encode_seconds += time.perf_counter() - start
+            self.batch_texts.record(len(texts))
+            self.batch_requests.record(len(batch))
+        offset = 0
+        for request in batch:
+            request.future.set_result(vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+
+    def stats(self):
+        with self._metrics_lock:
+            return {
+                "model": self.state,
+                "loadSeconds": self.load_seconds,
+                "queueDepth": self._queue.qsize(),
+                "queueDepthAtSubmit": self.queue_depth.snapshot(),
+                "batchSize": self.batch_texts.snapshot(),
+                "requestsPerBatch": self.batch_requests.snapshot(),
+                "failedBatches": self.failed_batches,
+                "encodeSeconds": self.encode_seconds,
+                "maxBatch": self.max_batch,
+                "maxWaitMs": self.max_wait * 1000,
+            }
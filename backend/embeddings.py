@@ -0,0 +1,157 @@
+import hashlib
+import os
+import numpy as np
+from bson import Binary
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# Directory of a saved copy of the model (see save_embedding_model.py), so
+# startup doesn't have to resolve it through the Hugging Face cache
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH")
+
+# Fields stored alongside each message that are never sent back to the extension
+EMBEDDING_FIELDS = ("embedding", "embeddingHash", "embeddingModel")
+
+# How new embeddings are stored: packed float16 (default), int8 with a per-vector
+# scale, or float32, each as BSON binary with its own user-defined subtype.
+# Embeddings stored as arrays of doubles (before packing) are still read.
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float16").lower()
+EMBEDDING_SUBTYPES = {"float32": 0x80, "float16": 0x81, "int8": 0x82}
+
+
+def load_embedding_model(backend=None):
+    """
+    The sentence transformer on the configured embedding backend (see
+    embedding_backends.py); sentence_transformers (and torch) are only imported here
+    """
+    from embedding_backends import load_embedding_backend
+    if EMBEDDING_MODEL_PATH:
+        if os.path.isdir(EMBEDDING_MODEL_PATH):
+            return load_embedding_backend(EMBEDDING_MODEL_PATH, backend)
+        print(f"EMBEDDING_MODEL_PATH {EMBEDDING_MODEL_PATH} not found, loading {EMBEDDING_MODEL_NAME}")
+    return load_embedding_backend(EMBEDDING_MODEL_NAME, backend)
+
+
+def build_embedding_text(message):
+    """Build the text that gets embedded for a message (text plus its insights)"""
+    text = message.get("text", "")
+    insights = message.get("insights", [])
+    if insights:
+        text += (
+            " " + " ".join(insights)
+            if isinstance(insights, list)
+            else " " + insights
+        )
+    return text
+
+
+def embedding_hash(text):
+    """Hash of the embedded text, used to detect stale embeddings after edits"""
+    return hashlib.sha1(f"{EMBEDDING_MODEL_NAME}:{text}".encode("utf-8")).hexdigest()
+
+
+def encode_texts(model, texts):
+    """Encode a list of texts into an (n, dim) float32 matrix"""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(model.encode(texts), dtype=np.float32)
+
+
+def pack_embedding(vector, storage=EMBEDDING_STORAGE):
+    """The BSON binary stored for a vector"""
+    vector = np.asarray(vector, dtype=np.float32)
+    if storage == "float16":
+        data = vector.astype("<f2").tobytes()
+    elif storage == "int8":
+        # Prefixed with the scale that maps int8 back to floats
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        data = np.array(scale, dtype="<f4").tobytes() + np.round(vector / scale).astype(np.int8).tobytes()
+    elif storage == "float32":
+        data = vector.astype("<f4").tobytes()
+    else:
+        raise ValueError(f"Unknown embedding storage: {storage}")
+    return Binary(data, EMBEDDING_SUBTYPES[storage])
+
+
+def _unpack_rows(data, subtype, n):
+    """(n, dim) float32 matrix from n packed embeddings laid end to end in `data`, read with np.frombuffer"""
+    if subtype == EMBEDDING_SUBTYPES["float32"]:
+        return np.frombuffer(data, dtype="<f4").reshape(n, -1)
+    if subtype == EMBEDDING_SUBTYPES["float16"]:
+        return np.frombuffer(data, dtype="<f2").reshape(n, -1).astype(np.float32)
+    if subtype == EMBEDDING_SUBTYPES["int8"]:
+        dim = len(data) // n - 4
+        rows = np.frombuffer(data, dtype=np.dtype([("scale", "<f4"), ("values", "i1", (dim,))]))
+        return rows["values"] * rows["scale"][:, None]
+    raise ValueError(f"Unknown embedding subtype: {subtype}")
+
+
+def is_packed(value, storage=None):
+    """True if a stored embedding is packed binary (in the given storage format, if any)"""
+    if not isinstance(value, Binary):
+        return False
+    return value.subtype == EMBEDDING_SUBTYPES[storage] if storage else value.subtype in EMBEDDING_SUBTYPES.values()
+
+
+def embedding_vector(value):
+    """A stored embedding (packed binary or array of doubles) as a float32 vector"""
+    if is_packed(value):
+        return _unpack_rows(value, value.subtype, 1)[0]
+    return np.asarray(value, dtype=np.float32)
+
+
+def embedding_matrix(values):
+    """
+    Stored embeddings as an (n, dim) float32 matrix. When they are all packed
+    the same way (the usual case), they are decoded in one np.frombuffer call.
+    """
+    if not values:
+        return np.zeros((0, 0), dtype=np.float32)
+    first = values[0]
+    if is_packed(first) and all(
+        isinstance(v, Binary) and v.subtype == first.subtype and len(v) == len(first) for v in values
+    ):
+        return _unpack_rows(b"".join(values), first.subtype, len(values))
+    return np.asarray([embedding_vector(v) for v in values], dtype=np.float32)
+
+
+def is_embedding_stale(message):
+    """True if the message has no embedding or it was computed from different text"""
+    if not message.get("embedding"):
+        return True
+    return message.get("embeddingHash") != embedding_hash(build_embedding_text(message))
+
+
+def attach_embeddings(model, messages):
+    """
+    Compute embeddings for a list of message dicts (before insert) and store them
+    on the dicts in place. Does nothing if the model is not loaded.
+    """
+    if not model or not messages:
+        return messages
+    texts = [build_embedding_text(m) for m in messages]
+    vectors = encode_texts(model, texts)
+    for message, text, vector in zip(messages, texts, vectors):
+        message["embedding"] = pack_embedding(vector)
+        message["embeddingHash"] = embedding_hash(text)
+        message["embeddingModel"] = EMBEDDING_MODEL_NAME
+    return messages
+
+
+def embedding_update(message):
+    """The $set document that persists a message's embedding fields"""
+    return {field: message[field] for field in EMBEDDING_FIELDS}
+
+
+def ensure_embeddings(model, collection, messages):
+    """
+    Make sure every message has an up-to-date embedding, recomputing (and
+    persisting) only the ones that are missing or stale.
+    Returns an (n, dim) float32 matrix aligned with `messages`.
+    """
+    stale = [m for m in messages if is_embedding_stale(m)]
+    if stale:
+        attach_embeddings(model, stale)
+        for m in stale:
+            collection.update_one({"_id": m["_id"]}, {"$set": embedding_update(m)})
+    return embedding_matrix([m["embedding"] for m in messages])
+
@@ -0,0 +1,144 @@
+"""
+Folder membership storage.
+
+Folder metadata (folderID, name, description, created_at) lives in the user's
+document, but which messages are in which folder is stored one document per
+membership in the folder_memberships collection:
+
+    {"userID": ..., "folderID": ..., "messageID": ..., "addedAt": ...}
+
+Every change is a single atomic insert/delete, so concurrent requests can't
+overwrite each other's changes, writes don't grow with the size of the library,
+and a user document can no longer approach the 16MB limit. Documents are listed
+in _id order, which is the order messages were added to the folder.
+"""
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from db import memberships_collection, users_collection
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def add_to_folder(userID, folder_id, message_ids):
+    """Add messages to a folder, ignoring ones already in it. Returns how many were added."""
+    return add_memberships(userID, [(folder_id, mid) for mid in message_ids])
+
+
+def add_memberships(userID, pairs):
+    """Add (folder_id, message_id) memberships in one bulk write. Returns how many were new."""
+    now = datetime.now().isoformat()
+    operations = [
+        UpdateOne(
+            {"userID": userID, "folderID": folder_id, "messageID": message_id},
+            {"$setOnInsert": {"addedAt": now}},
+            upsert=True,
+        )
+        for folder_id, message_id in pairs
+    ]
+    return _bulk_upsert(operations)
+
+
+def _bulk_upsert(operations):
+    """Run membership upserts, returning how many documents were inserted"""
+    if not operations:
+        return 0
+    try:
+        return memberships_collection.bulk_write(operations, ordered=False).upserted_count
+    except BulkWriteError as e:
+        # Two requests upserting the same membership at once: one of them wins
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+        return e.details.get("nUpserted", 0)
+
+
+def remove_from_folder(userID, folder_id, message_ids):
+    result = memberships_collection.delete_many(
+        {"userID": userID, "folderID": folder_id, "messageID": {"$in": list(message_ids)}}
+    )
+    return result.deleted_count
+
+
+def remove_messages_from_all_folders(userID, message_ids):
+    memberships_collection.delete_many({"userID": userID, "messageID": {"$in": list(message_ids)}})
+
+
+def move_memberships(userID, replacements):
+    """Point the memberships of each message in `replacements` ({old id: new id}) at the new id"""
+    old_ids = list(replacements)
+    pairs = [
+        (m["folderID"], replacements[m["messageID"]])
+        for m in memberships_collection.find(
+            {"userID": userID, "messageID": {"$in": old_ids}}, {"folderID": 1, "messageID": 1}
+        )
+    ]
+    add_memberships(userID, pairs)
+    remove_messages_from_all_folders(userID, old_ids)
+
+
+def delete_folder_memberships(userID, folder_id):
+    memberships_collection.delete_many({"userID": userID, "folderID": folder_id})
+
+
+def clear_memberships(userID):
+    memberships_collection.delete_many({"userID": userID})
+
+
+def folder_message_ids(userID, folder_id, offset=0, limit=None):
+    """Message ids in a folder, in the order they were added"""
+    cursor = memberships_collection.find(
+        {"userID": userID, "folderID": folder_id}, {"messageID": 1, "_id": 0}
+    ).sort("_id", 1).skip(offset)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return [m["messageID"] for m in cursor]
+
+
+def folder_size(userID, folder_id):
+    return memberships_collection.count_documents({"userID": userID, "folderID": folder_id})
+
+
+def folder_message_map(userID):
+    """{folder_id: [message ids in insertion order]} for all of a user's folders"""
+    by_folder = {}
+    cursor = memberships_collection.find(
+        {"userID": userID}, {"folderID": 1, "messageID": 1}
+    ).sort([("folderID", 1), ("_id", 1)])
+    for m in cursor:
+        by_folder.setdefault(m["folderID"], []).append(m["messageID"])
+    return by_folder
+
+
+def categorized_message_ids(userID, message_ids=None):
+    """Ids of all messages (or of those among `message_ids`) that are in at least one folder"""
+    query = {"userID": userID}
+    if message_ids is not None:
+        query["messageID"] = {"$in": list(message_ids)}
+    return set(memberships_collection.distinct("messageID", query))
+
+
+def migrate_user_memberships(user):
+    """
+    Move ids from the legacy embedded folders[].messages arrays into the
+    memberships collection, keeping their order, then drop the arrays.
+    Safe to run more than once. Returns how many memberships were added.
+    """
+    folders = user.get("folders", [])
+    if not any("messages" in f for f in folders):
+        return 0
+    now = datetime.now().isoformat()
+    operations = [
+        UpdateOne(
+            {"userID": user["userID"], "folderID": f["folderID"], "messageID": mid},
+            # Ids are generated in order, so _id order matches the old array order
+            {"$setOnInsert": {"_id": ObjectId(), "addedAt": now}},
+            upsert=True,
+        )
+        for f in folders
+        for mid in f.get("messages", [])
+    ]
+    added = _bulk_upsert(operations)
+    users_collection.update_one({"_id": user["_id"]}, {"$unset": {"folders.$[].messages": ""}})
+    return added
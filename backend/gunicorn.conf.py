@@ -0,0 +1,43 @@
+"""
+Production server config: `gunicorn -c gunicorn.conf.py app:app`.
+
+The app (and with it the sentence transformer) is imported once in the master
+before workers are forked (preload_app), so workers share the model's memory
+copy-on-write instead of each loading their own copy. Anything that must not
+cross a fork is set up per worker instead: job worker threads and the index
+bootstrap are started in post_fork and the LLM event loop thread starts lazily on first use (PyMongo
+resets its connection pools in forked children by itself).
+
+    WEB_CONCURRENCY   worker processes (default: CPU count)
+    GUNICORN_THREADS  request threads per worker (default 4)
+    GUNICORN_TIMEOUT  seconds before a silent worker is restarted (default 120)
+"""
+import gc
+import multiprocessing
+import os
+
+# Read by app.py at import: load the model before forking, and start the
+# background threads in post_fork instead
+os.environ.setdefault("EMBEDDING_MODEL_LOAD", "eager")
+os.environ.setdefault("BACKGROUND_THREADS_ON_IMPORT", "false")
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+preload_app = True
+accesslog = "-"
+
+
+def when_ready(server):
+    # Objects created at import are never freed, so keep the collector from
+    # touching them (and un-sharing their pages) in the workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import model, start_background_threads
+    start_background_threads()
+    # The model is already loaded; this runs the warm-up encode in the worker
+    model.load_in_background()
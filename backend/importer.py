@@ -0,0 +1,74 @@
+"""
+Incremental parsing of ChatGPT data exports (conversations.json).
+
+The export is a JSON array of conversations (or a single conversation object).
+Conversations are read one at a time with ijson, so memory use depends on the
+largest single conversation rather than the size of the file. Each
+conversation's messages live in a `mapping` of nodes linked by `parent`; the
+thread shown in ChatGPT is the chain of parents from `current_node`.
+"""
+from datetime import datetime
+import ijson
+
+# Roles whose messages are kept in the transcript
+TRANSCRIPT_ROLES = ("user", "assistant")
+
+
+def iter_conversations(stream, skip=0):
+    """
+    Yield (index, conversation) from a conversations.json stream, skipping the
+    first `skip` (already imported) conversations.
+    """
+    first = _first_char(stream)
+    prefix = "item" if first == "[" else ""
+    for index, conversation in enumerate(ijson.items(stream, prefix, use_float=True)):
+        if index >= skip and isinstance(conversation, dict):
+            yield index, conversation
+
+
+def _first_char(stream):
+    """Peek at the first non-whitespace character, then rewind"""
+    start = stream.tell()
+    while True:
+        char = stream.read(1)
+        if not char or not char.isspace():
+            break
+    stream.seek(start)
+    return char.decode() if isinstance(char, bytes) else char
+
+
+def conversation_messages(conversation):
+    """[(role, text)] for the conversation's visible thread, oldest first"""
+    mapping = conversation.get("mapping") or {}
+    node_id = conversation.get("current_node")
+    if node_id in mapping:
+        nodes = []
+        while node_id in mapping:
+            nodes.append(mapping[node_id])
+            node_id = mapping[node_id].get("parent")
+        nodes.reverse()
+    else:
+        nodes = list(mapping.values())
+    messages = []
+    for node in nodes:
+        message = node.get("message") or {}
+        role = (message.get("author") or {}).get("role")
+        if role not in TRANSCRIPT_ROLES:
+            continue
+        parts = (message.get("content") or {}).get("parts") or []
+        text = "\n".join(part.strip() for part in parts if isinstance(part, str) and part.strip())
+        if text:
+            messages.append((role, text))
+    return messages
+
+
+def conversation_transcript(conversation):
+    """The conversation as a "role: text" transcript, the same format the extension sends to /full-chat"""
+    return "\n\n".join(f"{role}: {text}" for role, text in conversation_messages(conversation))
+
+
+def conversation_timestamp(conversation):
+    created = conversation.get("create_time")
+    if isinstance(created, (int, float)):
+        return datetime.fromtimestamp(created).isoformat()
+    return datetime.now().isoformat()
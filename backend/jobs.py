@@ -0,0 +1,200 @@
+"""
+Durable background job queue backed by the MongoDB `jobs` collection, with a
+local pool of worker threads.
+
+A job document looks like:
+
+    {"type": "process_message", "userID": ..., "payload": {...},
+     "status": "pending" | "running" | "done" | "failed",
+     "attempts": 0, "runAt": ..., "leaseUntil": ..., "progress": {...},
+     "result": ..., "error": ..., "createdAt": ..., "updatedAt": ..., "finishedAt": ...}
+
+Workers claim jobs atomically with find_one_and_update, so any number of
+processes can share the queue. Each job type belongs to a named queue with its
+own worker threads, so long jobs (imports) can't occupy the workers that
+quick per-message jobs need. A claimed job holds a lease; if the process
+dies, the job becomes claimable again once the lease expires. Finished jobs
+(done or finally failed) are deleted by a TTL index on finishedAt after
+JOB_RETENTION_SECONDS.
+"""
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from db import jobs_collection
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))
+DEFAULT_QUEUE = "default"
+
+_handlers = {}
+_failure_handlers = {}
+_queues = {}  # job type -> queue name
+_wakeup = threading.Event()
+
+
+def job_handler(job_type, on_failure=None, queue=DEFAULT_QUEUE):
+    """
+    Register a function that runs jobs of `job_type`. It receives the job
+    document, as does `on_failure`, which runs once a job has failed for the
+    last time (to clean up after it). Jobs are run by the workers of `queue`.
+    """
+    def register(fn):
+        _handlers[job_type] = fn
+        _queues[job_type] = queue
+        if on_failure is not None:
+            _failure_handlers[job_type] = on_failure
+        return fn
+    return register
+
+
+def enqueue_job(job_type, userID, payload):
+    """Queue a job and return its id as a string"""
+    now = datetime.now()
+    job = {
+        "type": job_type,
+        "userID": userID,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "runAt": now,
+        "progress": {},
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    result = jobs_collection.insert_one(job)
+    _wakeup.set()
+    return str(result.inserted_id)
+
+
+def get_job(userID, job_id):
+    if not ObjectId.is_valid(job_id):
+        return None
+    return jobs_collection.find_one({"_id": ObjectId(job_id), "userID": userID})
+
+
+def update_job_progress(job, **progress):
+    """Record progress for a running job (e.g. done=10, total=200)"""
+    job["progress"].update(progress)
+    jobs_collection.update_one(
+        {"_id": job["_id"]},
+        {"$set": {"progress": job["progress"], "updatedAt": datetime.now(),
+                  "leaseUntil": datetime.now() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+    )
+
+
+def serialize_job(job):
+    """The job fields exposed through the API"""
+    return {
+        "id": str(job["_id"]),
+        "type": job["type"],
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "progress": job.get("progress", {}),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "createdAt": job["createdAt"].isoformat(),
+        "updatedAt": job["updatedAt"].isoformat(),
+    }
+
+
+def claim_job(queue=None):
+    """Atomically take the next runnable job (of `queue`, or of any queue if None), or return None"""
+    now = datetime.now()
+    job_types = [t for t in _handlers if queue is None or _queues[t] == queue]
+    return jobs_collection.find_one_and_update(
+        {
+            "type": {"$in": job_types},
+            "$or": [
+                {"status": "pending", "runAt": {"$lte": now}},
+                # Lease expired: the worker that claimed it is gone
+                {"status": "running", "leaseUntil": {"$lte": now}},
+            ],
+        },
+        {
+            "$set": {"status": "running", "leaseUntil": now + timedelta(seconds=JOB_LEASE_SECONDS), "updatedAt": now},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("runAt", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def run_job(job):
+    handler = _handlers[job["type"]]
+    try:
+        result = handler(job)
+        jobs_collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "done", "result": result, "updatedAt": datetime.now(),
+                      "finishedAt": datetime.utcnow()},
+             "$unset": {"leaseUntil": ""}},
+        )
+    except Exception as e:
+        traceback.print_exc()
+        failed = job["attempts"] >= JOB_MAX_ATTEMPTS
+        retry_at = datetime.now() + timedelta(seconds=2 ** job["attempts"])
+        update = {"status": "failed" if failed else "pending", "error": str(e),
+                  "runAt": retry_at, "updatedAt": datetime.now()}
+        if failed:
+            update["finishedAt"] = datetime.utcnow()
+        jobs_collection.update_one({"_id": job["_id"]}, {"$set": update, "$unset": {"leaseUntil": ""}})
+        on_failure = _failure_handlers.get(job["type"])
+        if failed and on_failure is not None:
+            try:
+                on_failure(job)
+            except Exception:
+                traceback.print_exc()
+
+
+def run_pending_jobs(limit=None, queue=None):
+    """Run queued jobs in the current thread until none are left (or `limit` ran)"""
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim_job(queue)
+        if not job:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+class JobWorkerPool:
+    """Worker threads that poll one queue and run its jobs"""
+
+    def __init__(self, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL, queue=DEFAULT_QUEUE):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.queue = queue
+        self._threads = []
+        self._stop = threading.Event()
+
+    def start(self):
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{self.queue}-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job = claim_job(self.queue)
+            except Exception as e:
+                print(f"Error claiming job: {e}")
+                job = None
+            if job:
+                run_job(job)
+                continue
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
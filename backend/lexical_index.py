@@ -0,0 +1,114 @@
+"""
+Per-user BM25 inverted index for lexical search, and reciprocal rank fusion
+for combining its ranking with the semantic one.
+
+Semantic search is good at paraphrases but can miss exact terms (names, IDs,
+error codes); BM25 ranks memories by the query terms they contain, weighted
+by how rare each term is in the user's library. The index lives in memory
+next to the user's VectorIndex, is updated on every write, and answers
+without the embedding model.
+"""
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Rank constant of reciprocal rank fusion: higher values flatten the
+# advantage of the very top ranks
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {id: term frequency}
+        self._doc_terms = {}  # id -> its distinct terms, for removal
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def __contains__(self, item_id):
+        return item_id in self._doc_lengths
+
+    def add(self, ids, texts):
+        """Add (or replace) the documents for the given ids"""
+        with self._lock:
+            for item_id, text in zip(ids, texts):
+                self.remove(item_id)
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                for term, tf in counts.items():
+                    self._postings[term][item_id] = tf
+                self._doc_terms[item_id] = tuple(counts)
+                self._doc_lengths[item_id] = len(tokens)
+                self._total_length += len(tokens)
+
+    def remove(self, item_id):
+        with self._lock:
+            if item_id not in self._doc_lengths:
+                return False
+            for term in self._doc_terms.pop(item_id):
+                postings = self._postings[term]
+                postings.pop(item_id, None)
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._doc_lengths.pop(item_id)
+            return True
+
+    def search(self, query, top_k=None, ids=None):
+        """
+        [(id, score)] of documents containing any query term, best first.
+        With `ids`, only those documents are candidates.
+        """
+        if ids is not None and not isinstance(ids, (set, frozenset)):
+            ids = set(ids)
+        with self._lock:
+            n_docs = len(self)
+            if n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs or 1.0
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                if ids is None:
+                    matches = postings.items()
+                elif len(ids) < len(postings):
+                    matches = [(item_id, postings[item_id]) for item_id in ids if item_id in postings]
+                else:
+                    matches = [(item_id, tf) for item_id, tf in postings.items() if item_id in ids]
+                for item_id, tf in matches:
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[item_id] / avg_length)
+                    scores[item_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if top_k is None:
+            return sorted(scores.items(), key=lambda hit: -hit[1])
+        return heapq.nlargest(top_k, scores.items(), key=lambda hit: hit[1])
+
+
+def reciprocal_rank_fusion(rankings, k=HYBRID_RRF_K):
+    """
+    Fuse several [(id, score)] rankings into one [(id, fused score)], best
+    first. Only ranks are used, so rankers with incomparable scores (BM25 and
+    cosine) can be combined.
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, (item_id, _) in enumerate(ranking):
+            fused[item_id] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda hit: -hit[1])
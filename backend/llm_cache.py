@@ -0,0 +1,164 @@
+"""
+Content-addressed cache for LLM results.
+
+Keys are a hash of (provider, model, prompt template, inputs), so the same
+conversation re-synced or re-imported reuses the earlier result, while changing
+the prompt template or the model naturally misses. Backends are pluggable:
+
+    memory - in-process LRU (LLM_CACHE_SIZE entries)
+    mongo  - the llm_cache collection, expired by a TTL index (LLM_CACHE_TTL_SECONDS)
+    tiered - memory in front of mongo (default)
+    off    - no caching
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+LLM_CACHE = os.getenv("LLM_CACHE", "tiered").lower()
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 5000))
+
+
+def cache_key(provider, model, template, inputs):
+    template_hash = hashlib.sha256(template.encode("utf-8")).hexdigest()
+    payload = json.dumps([provider, model, template_hash, inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """Thread-safe in-process LRU"""
+
+    name = "memory"
+
+    def __init__(self, max_size=LLM_CACHE_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class MongoCacheBackend:
+    """Shared across processes; entries expire through the TTL index on createdAt"""
+
+    name = "mongo"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, key):
+        doc = self.collection.find_one({"_id": key}, {"value": 1})
+        return doc["value"] if doc else None
+
+    def set(self, key, value):
+        self.collection.update_one(
+            {"_id": key}, {"$set": {"value": value, "createdAt": datetime.utcnow()}}, upsert=True
+        )
+
+
+class TieredCacheBackend:
+    """Checks backends in order and fills the faster ones on a hit further down"""
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.name = "+".join(b.name for b in backends)
+
+    def get(self, key):
+        for i, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is not None:
+                for faster in self.backends[:i]:
+                    faster.set(key, value)
+                return value
+        return None
+
+    def set(self, key, value):
+        for backend in self.backends:
+            backend.set(key, value)
+
+
+class LLMCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.errors = 0
+
+    def get(self, key, use_cache=True):
+        """Cached value or None. use_cache=False counts as a bypass and always misses."""
+        if self.backend is None:
+            return None
+        if not use_cache:
+            self._count("bypassed")
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"Error reading LLM cache: {e}")
+            self._count("errors")
+            return None
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key, value):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print(f"Error writing LLM cache: {e}")
+            self._count("errors")
+
+    async def aget(self, key, use_cache=True):
+        """get() for coroutines, run in a thread so a Mongo lookup doesn't block the event loop"""
+        if self.backend is None or not use_cache:
+            return self.get(key, use_cache)
+        return await asyncio.to_thread(self.get, key, use_cache)
+
+    async def aset(self, key, value):
+        if self.backend is not None:
+            await asyncio.to_thread(self.set, key, value)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.backend.name if self.backend else "off",
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "errors": self.errors,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def build_cache(kind=LLM_CACHE):
+    if kind == "off":
+        return LLMCache(None)
+    if kind == "memory":
+        return LLMCache(MemoryCacheBackend())
+    from db import llm_cache_collection
+    if kind == "mongo":
+        return LLMCache(MongoCacheBackend(llm_cache_collection))
+    return LLMCache(TieredCacheBackend([MemoryCacheBackend(), MongoCacheBackend(llm_cache_collection)]))
@@ -0,0 +1,269 @@
+"""
+LLM providers behind one interface, shared by LLM.py and app.py.
+
+Providers are asyncio-based. All LLM coroutines run on one shared event loop
+in a background thread, so a request can have many calls in flight without
+tying up a thread per call; sync code (Flask routes, job workers) submits
+work to it with run_sync(). Each provider keeps a single long-lived async SDK
+client (created on first use), so the SDK's HTTP connection pool is kept
+alive across calls instead of being set up per request. `acomplete(prompt)`
+adds what every provider needs:
+
+    - a per-provider limit on calls in flight (LLM_MAX_IN_FLIGHT)
+    - a request timeout (LLM_TIMEOUT)
+    - retries of transient failures (connection errors, 408/409/429/5xx) with
+      full-jitter exponential backoff (LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY)
+
+Providers (LLM_PROVIDER): claude (default), openai, stub (instant canned
+responses) and fake (canned responses with simulated latency and transient
+errors, for benchmarking throughput offline; see benchmark_llm_throughput.py).
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+from constants import AUTO_CATEGORIZE_PROMPT, BATCH_AUTOPOPULATE_PROMPT, BATCH_CATEGORIZE_PROMPT
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = 20.0
+# Max calls in flight per provider; unset uses the provider's default
+LLM_MAX_IN_FLIGHT = os.getenv("LLM_MAX_IN_FLIGHT")
+# Simulated per-call latency (seconds) and transient error rate of the fake provider
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", 0.5))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", 0.0))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class TransientLLMError(Exception):
+    """A failure worth retrying (raised by the fake provider)"""
+
+
+class EventLoopThread:
+    """An asyncio event loop running in a daemon thread, started on first use"""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        """Run a coroutine on the loop and block until it finishes"""
+        loop = self.loop
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run_sync() called from the event loop; await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+event_loop = EventLoopThread()
+
+
+def run_sync(coro):
+    """Run an LLM coroutine from sync code and return its result"""
+    return event_loop.run(coro)
+
+
+class LLMProvider:
+    name = None
+    default_model = None
+    default_max_in_flight = 8
+
+    def __init__(self, model=None, max_in_flight=None, timeout=LLM_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, retry_base_delay=LLM_RETRY_BASE_DELAY):
+        self.model = model or os.getenv("LLM_MODEL") or self.default_model
+        self.max_in_flight = int(max_in_flight or LLM_MAX_IN_FLIGHT or self.default_max_in_flight)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        # Only used on the shared event loop, so created lazily there
+        self._slots = None
+        self._client = None
+
+    @property
+    def client(self):
+        """The provider's async SDK client, created once and reused by every call"""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    async def acomplete(self, prompt, max_tokens=800, temperature=0.3):
+        """Text of the model's reply to `prompt`, retrying transient failures"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        attempt = 0
+        while True:
+            try:
+                async with self._slots:
+                    content = await self._acomplete(prompt, max_tokens, temperature)
+                if not content:
+                    raise Exception("No response content received")
+                return content
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+
+    def complete(self, prompt, max_tokens=800, temperature=0.3):
+        """Blocking acomplete() for sync callers"""
+        return run_sync(self.acomplete(prompt, max_tokens, temperature))
+
+    def backoff(self, attempt):
+        """Full jitter: a random delay up to base * 2**attempt, so retries don't arrive in lockstep"""
+        return random.uniform(0, min(LLM_RETRY_MAX_DELAY, self.retry_base_delay * 2 ** attempt))
+
+    def is_retryable(self, error):
+        return isinstance(error, TransientLLMError)
+
+    def _create_client(self):
+        return None
+
+    async def _acomplete(self, prompt, max_tokens, temperature):
+        raise NotImplementedError
+
+
+class SDKProvider(LLMProvider):
+    """Shared retry classification for the Anthropic and OpenAI SDKs, which use the same error types"""
+
+    sdk = None
+
+    def is_retryable(self, error):
+        if isinstance(error, self.sdk.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+        # Includes timeouts
+        return isinstance(error, self.sdk.APIConnectionError)
+
+
+class AnthropicProvider(SDKProvider):
+    name = "claude"
+    default_model = "claude-3-5-haiku-latest"
+
+    def __init__(self, **kwargs):
+        import anthropic
+        self.sdk = anthropic
+        super().__init__(**kwargs)
+
+    def _create_client(self):
+        if not os.getenv("ANTHROPIC_API_KEY"):
+            raise Exception("Anthropic API key not configured")
+        # Retries are handled in complete(), so the SDK's own are turned off
+        return self.sdk.AsyncAnthropic(timeout=self.timeout, max_retries=0)
+
+    async def _acomplete(self, prompt, max_tokens, temperature):
+        response = await self.client.messages.create(
+            model=self.model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        content = ""
+        for block in response.content:
+            if block.type == "text":
+                content += block.text
+        return content.strip()
+
+
+class OpenAIProvider(SDKProvider):
+    name = "openai"
+    default_model = "gpt-4o-mini"
+
+    def __init__(self, **kwargs):
+        import openai
+        self.sdk = openai
+        super().__init__(**kwargs)
+
+    def _create_client(self):
+        if not os.getenv("OPENAI_API_KEY"):
+            raise Exception("OpenAI API key not configured")
+        return self.sdk.AsyncOpenAI(timeout=self.timeout, max_retries=0)
+
+    async def _acomplete(self, prompt, max_tokens, temperature):
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+
+
+class StubProvider(LLMProvider):
+    """Offline provider for local development and tests, no API calls"""
+
+    name = "stub"
+    default_model = "stub"
+    default_max_in_flight = 64
+
+    async def _acomplete(self, prompt, max_tokens, temperature):
+        return stub_llm_response(prompt)
+
+
+class FakeProvider(StubProvider):
+    """Stub responses with simulated network latency and transient errors, for offline benchmarks"""
+
+    name = "fake"
+    default_model = "fake"
+
+    def __init__(self, latency=LLM_FAKE_LATENCY, error_rate=LLM_FAKE_ERROR_RATE, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.error_rate = error_rate
+
+    async def _acomplete(self, prompt, max_tokens, temperature):
+        # Latency varies +/-50% around the mean, like a real model
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self.error_rate and random.random() < self.error_rate:
+            raise TransientLLMError("Simulated transient error")
+        return stub_llm_response(prompt)
+
+
+def stub_llm_response(prompt):
+    """Deterministic canned response in the format each prompt template expects"""
+    if prompt.startswith(AUTO_CATEGORIZE_PROMPT.split("\n")[0]):
+        return json.dumps(["Misc"])
+    if prompt.startswith(BATCH_AUTOPOPULATE_PROMPT.split("\n")[0]):
+        return json.dumps([])
+    if prompt.startswith(BATCH_CATEGORIZE_PROMPT.split("\n")[0]):
+        return json.dumps({mid: ["Misc"] for mid in re.findall(r"^- ID: (\S+) \|", prompt, re.M)})
+    # Insight prompts end with the message text; use its last line as the memory
+    lines = [line.strip() for line in prompt.strip().split("\n") if line.strip()]
+    return json.dumps({"memories": [lines[-1][:120]]})
+
+
+PROVIDERS = {
+    "claude": AnthropicProvider,
+    "openai": OpenAIProvider,
+    "stub": StubProvider,
+    "fake": FakeProvider,
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name=None):
+    """The shared provider instance for `name` (default LLM_PROVIDER)"""
+    name = (name or os.getenv("LLM_PROVIDER", "claude")).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = PROVIDERS[name]()
+        return _providers[name]
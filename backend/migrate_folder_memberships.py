@@ -0,0 +1,29 @@
+"""
+One-off migration of folder membership out of the embedded users.folders[].messages
+arrays into the folder_memberships collection (see folders.py).
+
+Users that haven't been migrated are also migrated lazily the next time they
+make a request, so this can run while the app is serving traffic.
+
+Usage:
+    python migrate_folder_memberships.py
+"""
+from db import users_collection, ensure_indexes
+from folders import migrate_user_memberships
+
+
+def migrate_all():
+    users = 0
+    memberships = 0
+    for user in users_collection.find({"folders.messages": {"$exists": True}}):
+        memberships += migrate_user_memberships(user)
+        users += 1
+        print(f"Migrated folders for user {user['userID']}")
+    return users, memberships
+
+
+if __name__ == "__main__":
+    # The unique membership index must exist before upserting
+    ensure_indexes()
+    users, memberships = migrate_all()
+    print(f"Done: migrated {users} users, {memberships} folder memberships")
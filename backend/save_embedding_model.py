@@ -0,0 +1,26 @@
+"""
+Save the embedding model to a local directory, so the backend can load it from
+disk (EMBEDDING_MODEL_PATH) instead of resolving it through the Hugging Face
+cache or downloading it at startup. The Docker image does this at build time.
+
+The directory is a copy of the model's hub repo, including its ONNX exports,
+so it works with every embedding backend.
+
+Usage:
+    python save_embedding_model.py models/all-MiniLM-L6-v2
+"""
+import argparse
+from embeddings import EMBEDDING_MODEL_NAME
+
+# Weights for other frameworks, duplicates of model.safetensors and graph-optimized
+# ONNX variants no backend uses
+IGNORE_PATTERNS = ["*.h5", "*.ot", "*.msgpack", "pytorch_model.bin", "openvino/*", "onnx/model_O*.onnx"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save the embedding model to a directory")
+    parser.add_argument("path")
+    args = parser.parse_args()
+    from huggingface_hub import snapshot_download
+    snapshot_download(f"sentence-transformers/{EMBEDDING_MODEL_NAME}", local_dir=args.path,
+                      ignore_patterns=IGNORE_PATTERNS)
+    print(f"Saved {EMBEDDING_MODEL_NAME} to {args.path}")
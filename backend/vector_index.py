@@ -0,0 +1,319 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Users with fewer vectors than this are searched by brute force (exact)
+IVF_MIN_SIZE = int(os.getenv("VECTOR_INDEX_MIN_SIZE", 2000))
+# Fraction of inverted lists probed per query
+IVF_PROBE_FRACTION = float(os.getenv("VECTOR_INDEX_PROBE_FRACTION", 0.2))
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE_SIZE = 20000
+# Per-user indexes kept in memory (per cache); the least recently used are dropped
+INDEX_CACHE_USERS = int(os.getenv("INDEX_CACHE_USERS", 500))
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, without sorting everything"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+class VectorIndex:
+    """
+    In-memory cosine similarity index for one user's message embeddings.
+
+    Small indexes are searched exactly. Once an index has IVF_MIN_SIZE vectors it
+    is partitioned with k-means into ~sqrt(n) inverted lists (IVF-flat) and a
+    query only scores the vectors in the lists closest to it. Inserts and
+    deletes are incremental; the partitioning is retrained when the index has
+    doubled in size since the last training.
+    """
+
+    def __init__(self, dim=None):
+        self.dim = dim
+        self._vectors = None  # capacity-doubling buffer, rows [0, size) are live
+        self._ids = []
+        self._id_to_row = {}
+        self._centroids = None
+        self._assign = None  # list number for each row
+        self._lists = []  # row numbers in each list
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, item_id):
+        return item_id in self._id_to_row
+
+    @property
+    def is_trained(self):
+        return self._centroids is not None
+
+    def add(self, ids, vectors):
+        """Add (or replace) vectors for the given ids"""
+        vectors = normalize_rows(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            for item_id, vector in zip(ids, vectors):
+                if item_id in self._id_to_row:
+                    self._remove_row(self._id_to_row[item_id])
+                self._append_row(item_id, vector)
+            if len(self) >= IVF_MIN_SIZE and len(self) >= 2 * self._trained_size:
+                self.train()
+
+    def remove(self, item_id):
+        with self._lock:
+            row = self._id_to_row.get(item_id)
+            if row is None:
+                return False
+            self._remove_row(row)
+            if self.is_trained and len(self) < IVF_MIN_SIZE // 2:
+                self._drop_training()
+            return True
+
+    def search(self, query, top_k=None, exact=False, min_score=None, ids=None):
+        """
+        Return [(id, score)] for the top_k most similar vectors, best first.
+        With top_k=None every vector is scored exactly. Vectors scoring below
+        min_score are dropped before ranking. With `ids`, only those vectors
+        are candidates (scored exactly).
+        """
+        query = normalize_rows(query)[0]
+        with self._lock:
+            size = len(self)
+            if size == 0:
+                return []
+            if ids is not None:
+                rows, scores = self._score_subset(query, ids)
+            elif top_k is None or exact or not self.is_trained:
+                rows = None
+                scores = self._vectors[:size] @ query
+            else:
+                rows = self._candidate_rows(query)
+                scores = self._vectors[rows] @ query
+            if min_score is not None:
+                keep = np.flatnonzero(scores >= min_score)
+                rows = keep if rows is None else rows[keep]
+                scores = scores[keep]
+            k = len(scores) if top_k is None else min(top_k, len(scores))
+            best = top_k_indices(scores, k)
+            if rows is not None:
+                return [(self._ids[rows[i]], float(scores[i])) for i in best]
+            return [(self._ids[i], float(scores[i])) for i in best]
+
+    def _score_subset(self, query, ids):
+        """(rows, scores) for the given ids that are in the index"""
+        size = len(self)
+        rows = np.fromiter(
+            (self._id_to_row[item_id] for item_id in ids if item_id in self._id_to_row), dtype=np.int64
+        )
+        if len(rows) < size // 4:
+            # Few candidates: gather just their rows
+            return rows, self._vectors[rows] @ query
+        # Many candidates: scoring every row is cheaper than copying most of them
+        mask = np.zeros(size, dtype=bool)
+        mask[rows] = True
+        rows = np.flatnonzero(mask)
+        return rows, (self._vectors[:size] @ query)[rows]
+
+    def score_ids(self, query, ids):
+        """{id: cosine similarity to query} for the given ids that are in the index"""
+        query = normalize_rows(query)[0]
+        with self._lock:
+            known = [item_id for item_id in ids if item_id in self._id_to_row]
+            if not known:
+                return {}
+            rows = np.fromiter((self._id_to_row[item_id] for item_id in known), dtype=np.int64, count=len(known))
+            scores = self._vectors[rows] @ query
+            return {item_id: float(score) for item_id, score in zip(known, scores)}
+
+    def train(self):
+        """(Re)build the inverted lists with k-means over the current vectors"""
+        with self._lock:
+            size = len(self)
+            if size == 0:
+                return
+            vectors = self._vectors[:size]
+            n_lists = max(1, int(np.sqrt(size)))
+            rng = np.random.default_rng(0)
+            sample = vectors
+            if size > KMEANS_SAMPLE_SIZE:
+                sample = vectors[rng.choice(size, KMEANS_SAMPLE_SIZE, replace=False)]
+            centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+            for _ in range(KMEANS_ITERATIONS):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = normalize_rows(centroids)
+            self._centroids = centroids
+            self._assign = np.empty(len(self._vectors), dtype=np.int32)
+            self._assign[:size] = self._nearest_lists(vectors)
+            self._lists = [[] for _ in range(n_lists)]
+            for row, lst in enumerate(self._assign[:size]):
+                self._lists[lst].append(row)
+            self._trained_size = size
+
+    def _nearest_lists(self, vectors, chunk_size=8192):
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            block = vectors[start:start + chunk_size]
+            out[start:start + chunk_size] = np.argmax(block @ self._centroids.T, axis=1)
+        return out
+
+    def _candidate_rows(self, query):
+        n_lists = len(self._centroids)
+        n_probe = max(1, int(np.ceil(n_lists * IVF_PROBE_FRACTION)))
+        probes = top_k_indices(self._centroids @ query, n_probe)
+        rows = [row for lst in probes for row in self._lists[lst]]
+        return np.asarray(rows, dtype=np.int64)
+
+    def _drop_training(self):
+        self._centroids = None
+        self._assign = None
+        self._lists = []
+        self._trained_size = 0
+
+    def _append_row(self, item_id, vector):
+        size = len(self)
+        if self._vectors is None:
+            self._vectors = np.empty((16, self.dim), dtype=np.float32)
+        elif size == len(self._vectors):
+            grown = np.empty((2 * size, self.dim), dtype=np.float32)
+            grown[:size] = self._vectors[:size]
+            self._vectors = grown
+            if self._assign is not None:
+                assign = np.empty(2 * size, dtype=np.int32)
+                assign[:size] = self._assign[:size]
+                self._assign = assign
+        self._vectors[size] = vector
+        self._ids.append(item_id)
+        self._id_to_row[item_id] = size
+        if self.is_trained:
+            lst = int(np.argmax(self._centroids @ vector))
+            self._assign[size] = lst
+            self._lists[lst].append(size)
+
+    def _remove_row(self, row):
+        last = len(self) - 1
+        removed_id = self._ids[row]
+        if self.is_trained:
+            self._lists[self._assign[row]].remove(row)
+        if row != last:
+            # Move the last row into the freed slot
+            moved_id = self._ids[last]
+            self._vectors[row] = self._vectors[last]
+            self._ids[row] = moved_id
+            self._id_to_row[moved_id] = row
+            if self.is_trained:
+                lst = self._assign[last]
+                self._lists[lst][self._lists[lst].index(last)] = row
+                self._assign[row] = lst
+        self._ids.pop()
+        del self._id_to_row[removed_id]
+
+
+class VectorIndexCache:
+    """
+    Per-user VectorIndex instances (or another `index_class` with the same
+    add/remove interface), built on first use with `loader(user_id)`, which
+    must return (ids, items to add). At most `max_users` indexes are kept,
+    least recently used first out.
+
+    Each index is tagged with the `version` of the user's data it reflects
+    (see messages_version() in db.py). get() rebuilds an index whose version is
+    not the current one; add() and remove() move an index to the version of
+    the write they apply, as long as no other write happened in between.
+    """
+
+    def __init__(self, loader, index_class=VectorIndex, max_users=INDEX_CACHE_USERS):
+        self._loader = loader
+        self._index_class = index_class
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> [index, version]
+        self._lock = threading.Lock()
+        self._build_locks = {}  # user_id -> [lock held while their index is built, threads using it]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _current(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or (version is not None and entry[1] != version):
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def get(self, user_id, version=None):
+        """The user's index, rebuilt if it isn't cached at `version` (any version if None)"""
+        index = self._current(user_id, version)
+        if index is not None:
+            return index
+        # Builds only wait for other builds of the same user's index
+        with self._lock:
+            build_lock = self._build_locks.setdefault(user_id, [threading.Lock(), 0])
+            build_lock[1] += 1
+        try:
+            with build_lock[0]:
+                index = self._current(user_id, version)
+                if index is None:
+                    index = self._index_class()
+                    ids, vectors = self._loader(user_id)
+                    if len(ids):
+                        index.add(ids, vectors)
+                    with self._lock:
+                        self._entries[user_id] = [index, version]
+                        self._entries.move_to_end(user_id)
+                        while len(self._entries) > self.max_users:
+                            self._entries.popitem(last=False)
+                return index
+        finally:
+            with self._lock:
+                build_lock[1] -= 1
+                if not build_lock[1]:
+                    del self._build_locks[user_id]
+
+    def peek(self, user_id):
+        """The user's index if it has already been built, else None"""
+        entry = self._entries.get(user_id)
+        return entry[0] if entry is not None else None
+
+    def _advance(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            # Another write in between (in any process) leaves the index stale,
+            # so the next get() rebuilds it
+            if entry is not None and version is not None and entry[1] == version - 1:
+                entry[1] = version
+
+    def add(self, user_id, ids, vectors, version=None):
+        index = self.peek(user_id)
+        if index is not None and len(ids):
+            index.add(ids, vectors)
+        self._advance(user_id, version)
+
+    def remove(self, user_id, item_id, version=None):
+        index = self.peek(user_id)
+        if index is not None:
+            index.remove(item_id)
+        self._advance(user_id, version)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)